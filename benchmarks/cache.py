@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.cache
+    ~~~~~~~~~~~~~~~~
+
+    First request latency of a new invocation with a cold and a warm address cache.
+
+    Usage: python -m benchmarks.cache [--url URL] [--runs N] [--resolver-delay SECONDS]
+"""
+import ipaddress
+import socket
+import statistics
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from fortigate_vpn_login.cache import Cache
+from fortigate_vpn_login.fortigate import Fortigate
+from tests.gateway import StandInGateway
+
+
+def slow_resolver(delay: float) -> None:
+    """
+    Makes every hostname resolution take `delay` seconds more, like a captive or slow resolver.
+    """
+    getaddrinfo = socket.getaddrinfo
+
+    def delayed_getaddrinfo(host, *args, **kwargs):
+        try:
+            ipaddress.ip_address(host)
+        except ValueError:
+            time.sleep(delay)
+        return getaddrinfo(host, *args, **kwargs)
+
+    socket.getaddrinfo = delayed_getaddrinfo
+
+
+def first_request(url: str, cache_filename: Path) -> float:
+    """
+    Returns:
+        float: seconds taken by `connect_saml()` on a new `Fortigate`, like on a new invocation
+    """
+    fortigate = Fortigate(url, Cache(cache_filename))
+    start = time.perf_counter()
+    if not fortigate.connect_saml():
+        raise SystemExit(f"ERROR: {url} didn't answer")
+    elapsed = time.perf_counter() - start
+    fortigate.cache.write()
+    fortigate.session.close()
+    return elapsed
+
+
+def main() -> None:
+    parser = ArgumentParser(description='First request latency with a cold and a warm address cache.')
+    parser.add_argument('--url', help='Fortigate VPN server (default: a local stand-in, reached as localhost)')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--resolver-delay', type=float, default=0.0,
+                        help='seconds added to each hostname resolution (default: 0)')
+    args = parser.parse_args()
+
+    gateway = None
+    url = args.url
+    if not url:
+        gateway = StandInGateway('localhost')
+        gateway.start()
+        url = gateway.url
+
+    if args.resolver_delay:
+        slow_resolver(args.resolver_delay)
+
+    cold = []
+    warm = []
+    with tempfile.TemporaryDirectory() as directory:
+        for run in range(args.runs):
+            cache_filename = Path(directory) / f"cache-{run}.json"
+            cold.append(first_request(url, cache_filename))
+            warm.append(first_request(url, cache_filename))
+
+    if gateway:
+        gateway.stop()
+
+    print(f"First request to {url}, {args.runs} runs, resolver delay {args.resolver_delay}s")
+    for name, values in (('cold', cold), ('warm', warm)):
+        print(f"  {name}: median {statistics.median(values) * 1000:8.2f} ms, min {min(values) * 1000:8.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
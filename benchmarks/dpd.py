@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.dpd
+    ~~~~~~~~~~~~~~
+
+    Drops and wakeups of the adaptive DPD against a stand-in NAT, compared with fixed intervals.
+    Three throwaway network namespaces are linked by veth pairs: a client, a NAT and a gateway.
+    The client keeps a TCP tunnel (like openconnect with `--no-dtls`) through the NAT and sends a
+    dead peer detection probe on each interval. The NAT relays it to the gateway, which answers
+    the probes, and silently forgets a connection which stays idle for longer than its timeout,
+    like home routers do: the next probe gets no answer and the session drops.
+
+    The NAT is a userspace relay, since iptables/nft may not be available (or may not support
+    conntrack timeouts, like in gVisor). Time is scaled down: one second of the tuner is
+    `--scale` seconds of the benchmark.
+
+    Requires root and iproute2. Usage: python -m benchmarks.dpd [--nat-timeout SECONDS] [--sessions N]
+"""
+import os
+import random
+import select
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from typing import Optional, Tuple
+from fortigate_vpn_login import dpd
+
+PREFIX = f"fvl-dpd-{os.getpid()}"
+CLIENT = f"{PREFIX}-client"
+NAT = f"{PREFIX}-nat"
+GATEWAY = f"{PREFIX}-gw"
+
+# client <-> NAT and NAT <-> gateway links
+CLIENT_ADDRESS, NAT_INSIDE_ADDRESS = '10.98.0.2', '10.98.0.1'
+NAT_OUTSIDE_ADDRESS, GATEWAY_ADDRESS = '10.97.0.1', '10.97.0.2'
+PORT = 4443
+
+NETWORK = 'stand-in'
+
+
+def run_gateway(args: Namespace) -> None:
+    """
+    Answers each probe line with the same line, like the DPD responses of the server.
+    """
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self) -> None:
+            for line in self.rfile:
+                self.wfile.write(line)
+
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    socketserver.ThreadingTCPServer.daemon_threads = True
+    with socketserver.ThreadingTCPServer((GATEWAY_ADDRESS, PORT), Handler) as server:
+        print('ready', flush=True)
+        server.serve_forever()
+
+
+def relay(inside: socket.socket, outside: socket.socket, timeout: float) -> None:
+    """
+    Relays a connection until either side closes it. Once it was idle for longer than `timeout`
+    seconds, anything else is dropped.
+    """
+    last = time.monotonic()
+    forgotten = False
+    with inside, outside:
+        while True:
+            readable, _, _ = select.select([inside, outside], [], [])
+            now = time.monotonic()
+            if not forgotten and now - last > timeout:
+                forgotten = True
+            for sock in readable:
+                data = sock.recv(65536)
+                if not data:
+                    return
+                if not forgotten:
+                    (outside if sock is inside else inside).sendall(data)
+                    last = now
+
+
+def run_nat(args: Namespace) -> None:
+    timeout = args.nat_timeout * args.scale
+    with socket.socket() as listener:
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((NAT_INSIDE_ADDRESS, PORT))
+        listener.listen(64)
+        print('ready', flush=True)
+        while True:
+            inside, _ = listener.accept()
+            outside = socket.create_connection((GATEWAY_ADDRESS, PORT))
+            threading.Thread(target=relay, args=(inside, outside, timeout), daemon=True).start()
+
+
+def session(interval: int, length: float, scale: float) -> Tuple[float, bool]:
+    """
+    Keeps one tunnel up, probing it on each interval, until it drops or `length` seconds pass.
+
+    Returns:
+        tuple: the session duration in (unscaled) seconds, and whether it dropped
+    """
+    start = time.monotonic()
+    with socket.create_connection((NAT_INSIDE_ADDRESS, PORT)) as sock:
+        reader = sock.makefile('rb')
+        sock.settimeout(interval * scale)
+        while (time.monotonic() - start) / scale + interval <= length:
+            time.sleep(interval * scale)
+            sock.sendall(b'dpd\n')
+            try:
+                if not reader.readline():
+                    return (time.monotonic() - start) / scale, True
+            except socket.timeout:
+                return (time.monotonic() - start) / scale, True
+
+    return length, False
+
+
+def run_client(args: Namespace, fixed: Optional[int], randomness: random.Random) -> str:
+    """
+    Returns:
+        str: drops and wakeups per hour, with the last interval
+    """
+    drops = wakeups = 0
+    uptime = 0.0
+    with tempfile.TemporaryDirectory() as directory:
+        tuner = dpd.DPDTuner(Path(directory) / 'dpd.json')
+        for _ in range(args.sessions):
+            interval = fixed or tuner.get_interval(NETWORK)
+            if randomness.random() < args.failures:
+                # rejected cookie: openconnect exits right away with an error
+                duration, dropped = randomness.uniform(0.5, 3), True
+            else:
+                duration, dropped = session(interval, args.session_length, args.scale)
+                drops += dropped
+
+            uptime += duration
+            wakeups += int(duration / interval)
+            if not fixed:
+                tuner.record(NETWORK, duration, dropped)
+                tuner.write()
+
+        interval = fixed or tuner.get_interval(NETWORK)
+
+    hours = uptime / 3600
+    return f"{drops:3} drops ({drops / hours:.2f}/h), {wakeups / hours:4.0f} wakeups/h, last interval {interval}s"
+
+
+def run_clients(args: Namespace) -> None:
+    print(f"NAT timeout {args.nat_timeout:.0f}s, {args.sessions} sessions of up to {args.session_length:.0f}s, "
+          f"{args.failures:.0%} failed logins, time scaled by {args.scale}")
+    for name, fixed in (('fixed 60s', 60), (f"fixed {dpd.MIN_INTERVAL}s", dpd.MIN_INTERVAL), ('adaptive', None)):
+        report = run_client(args, fixed, random.Random(0))
+        print(f"  {name:>10}: {report}", flush=True)
+
+
+def ip(*arguments: str) -> None:
+    subprocess.run(['ip'] + list(arguments), check=True)
+
+
+def link(first: str, first_address: str, second: str, second_address: str, name: str) -> None:
+    ip('link', 'add', f"{name}a", 'netns', first, 'type', 'veth', 'peer', 'name', f"{name}b", 'netns', second)
+    for namespace, device, address in ((first, f"{name}a", first_address), (second, f"{name}b", second_address)):
+        ip('-n', namespace, 'addr', 'add', f"{address}/24", 'dev', device)
+        ip('-n', namespace, 'link', 'set', device, 'up')
+
+
+def start_role(namespace: str, role: str, args: Namespace) -> subprocess.Popen:
+    process = subprocess.Popen(['ip', 'netns', 'exec', namespace, sys.executable, '-m', 'benchmarks.dpd',
+                                '--role', role] + get_options(args), stdout=subprocess.PIPE, text=True)
+    process.stdout.readline()
+    return process
+
+
+def get_options(args: Namespace) -> list:
+    return ['--nat-timeout', str(args.nat_timeout), '--sessions', str(args.sessions), '--session-length',
+            str(args.session_length), '--failures', str(args.failures), '--scale', str(args.scale)]
+
+
+def main() -> None:
+    parser = ArgumentParser(description='Adaptive DPD against a stand-in NAT idle timeout, in network namespaces.')
+    parser.add_argument('--nat-timeout', type=float, default=45, help='NAT idle timeout in seconds (default: 45)')
+    parser.add_argument('--sessions', type=int, default=12)
+    parser.add_argument('--session-length', type=float, default=1000,
+                        help='seconds a session lasts unless it drops (default: 1000)')
+    parser.add_argument('--failures', type=float, default=0.1,
+                        help='fraction of sessions which fail before being established (default: 0.1)')
+    parser.add_argument('--scale', type=float, default=0.005,
+                        help='benchmark seconds per second of the tuner (default: 0.005)')
+    parser.add_argument('--role', choices=['client', 'nat', 'gateway'], help='internal: run inside a namespace')
+    args = parser.parse_args()
+
+    if args.role:
+        {'client': run_clients, 'nat': run_nat, 'gateway': run_gateway}[args.role](args)
+        return
+
+    if os.getuid() != 0:
+        raise SystemExit('ERROR: creating network namespaces requires root.')
+
+    processes = []
+    try:
+        for namespace in (CLIENT, NAT, GATEWAY):
+            ip('netns', 'add', namespace)
+            ip('-n', namespace, 'link', 'set', 'lo', 'up')
+        link(CLIENT, CLIENT_ADDRESS, NAT, NAT_INSIDE_ADDRESS, 'fvldpd0')
+        link(NAT, NAT_OUTSIDE_ADDRESS, GATEWAY, GATEWAY_ADDRESS, 'fvldpd1')
+
+        processes.append(start_role(GATEWAY, 'gateway', args))
+        processes.append(start_role(NAT, 'nat', args))
+        subprocess.run(['ip', 'netns', 'exec', CLIENT, sys.executable, '-m', 'benchmarks.dpd', '--role', 'client']
+                       + get_options(args), check=True)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        for namespace in (CLIENT, NAT, GATEWAY):
+            subprocess.run(['ip', 'netns', 'del', namespace], stderr=subprocess.DEVNULL)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.logs
+    ~~~~~~~~~~~~~~~
+
+    Cost of the debug logging of the VPN configuration when debug is disabled: formatting the
+    message up front (like the f-strings used before) versus passing the arguments to the logger.
+
+    Usage: python -m benchmarks.logs [--routes N] [--calls N]
+"""
+import logging
+import timeit
+from argparse import ArgumentParser
+from fortigate_vpn_login import logger, logs
+from fortigate_vpn_login.fortigate import Fortigate
+from tests.gateway import XML_CONFIG
+
+ROUTE = '      <addr ip="10.0.0.0" mask="255.0.0.0"/>\n'
+
+
+def get_xml_config(routes: int) -> str:
+    """
+    Returns:
+        str: the stand-in XML configuration with `routes` split routes
+    """
+    addresses = ''.join(f'      <addr ip="10.{(number >> 8) & 0xff}.{number & 0xff}.0" mask="255.255.255.0"/>\n'
+                        for number in range(routes))
+    return XML_CONFIG.replace(ROUTE, addresses)
+
+
+def main() -> None:
+    parser = ArgumentParser(description='Cost of the disabled debug logging of the VPN configuration.')
+    parser.add_argument('--routes', type=int, default=5000)
+    parser.add_argument('--calls', type=int, default=100)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logs.setup()
+
+    fortigate = Fortigate('https://vpn.example.com')
+    fortigate.xml_config = get_xml_config(args.routes)
+    fortigate.get_json_config()
+
+    def eager() -> None:
+        logger.debug(f"VPN JSON configuration: {fortigate.json_config}")
+
+    def lazy() -> None:
+        fortigate.get_json_config()
+
+    print(f"Debug logging disabled, {args.routes} routes, {args.calls} calls")
+    for name, function in (('formatted up front', eager), ('passed to the logger', lazy)):
+        elapsed = min(timeit.repeat(function, number=args.calls, repeat=5)) / args.calls
+        print(f"  {name:>20}: {elapsed * 1e6:10.2f} us per call")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.prewarm
+    ~~~~~~~~~~~~~~~~~~
+
+    Login latency saved by the pre-warm on network changes, in a throwaway network namespace:
+    an interface is flapped, the change is detected through netlink and the login is warmed up,
+    then the time until the browser can be opened is compared with a cold login.
+
+    Requires root and iproute2. Usage: python -m benchmarks.prewarm [--rounds N] [--resolver-delay SECONDS]
+"""
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from typing import List
+from fortigate_vpn_login import webserver
+from fortigate_vpn_login.fortigate import Fortigate
+from fortigate_vpn_login.netwatch import NetworkWatcher, Prewarmer
+from benchmarks.cache import slow_resolver
+from tests.gateway import StandInGateway
+
+NAMESPACE = f"fvl-bench-{os.getpid()}"
+INTERFACE = 'fvl-flap0'
+CALLBACK_PORT = 8020
+
+
+def wait_for_callback_listener(timeout: float = 10) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', CALLBACK_PORT), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.001)
+
+
+def cold_login(url: str) -> float:
+    """
+    Returns:
+        float: seconds until the browser can be opened, from a fresh start
+    """
+    fortigate = Fortigate(url)
+    start = time.perf_counter()
+    assert fortigate.connect_saml()
+    ws = webserver.run()
+    wait_for_callback_listener()
+    elapsed = time.perf_counter() - start
+
+    webserver.quit(ws)
+    fortigate.session.close()
+    return elapsed
+
+
+def warm_logins(url: str, rounds: int) -> List[tuple]:
+    """
+    Returns:
+        list: pairs of (seconds to detect the flap, seconds until the browser can be opened)
+    """
+    results = []
+    fortigate = Fortigate(url)
+    prewarmer = Prewarmer(fortigate)
+    with NetworkWatcher() as watcher:
+        for _ in range(rounds):
+            flapped = time.perf_counter()
+            subprocess.run(['ip', 'link', 'set', INTERFACE, 'down'], check=True)
+            subprocess.run(['ip', 'link', 'set', INTERFACE, 'up'], check=True)
+            assert watcher.wait(10)
+            detected = time.perf_counter() - flapped
+
+            # happens in background, before the user logs in
+            assert prewarmer.prewarm()
+            wait_for_callback_listener()
+
+            start = time.perf_counter()
+            assert fortigate.connect_saml()
+            ws = prewarmer.take_webserver()
+            wait_for_callback_listener()
+            results.append((detected, time.perf_counter() - start))
+            webserver.quit(ws)
+
+    prewarmer.close()
+    return results
+
+
+def run_inside(args) -> None:
+    subprocess.run(['ip', 'link', 'set', 'lo', 'up'], check=True)
+    subprocess.run(['ip', 'tuntap', 'add', 'dev', INTERFACE, 'mode', 'tap'], check=True)
+    subprocess.run(['ip', 'link', 'set', INTERFACE, 'up'], check=True)
+
+    gateway = StandInGateway('localhost')
+    gateway.start()
+    if args.resolver_delay:
+        slow_resolver(args.resolver_delay)
+
+    cold = [cold_login(gateway.url) for _ in range(args.rounds)]
+    warm = warm_logins(gateway.url, args.rounds)
+    gateway.stop()
+
+    print(f"Login until the browser can be opened, {args.rounds} rounds, resolver delay {args.resolver_delay}s")
+    print(f"  cold: median {statistics.median(cold) * 1000:8.2f} ms")
+    print(f"  warm: median {statistics.median(login for _, login in warm) * 1000:8.2f} ms")
+    print(f"  flap detected after a median of {statistics.median(detected for detected, _ in warm) * 1000:.0f} ms "
+          "(including the debounce)")
+
+
+def main() -> None:
+    parser = ArgumentParser(description='Login latency saved by the pre-warm on network changes.')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--resolver-delay', type=float, default=0.0,
+                        help='seconds added to each hostname resolution (default: 0)')
+    parser.add_argument('--inside', action='store_true', help='internal: already in the network namespace')
+    args = parser.parse_args()
+
+    if args.inside:
+        run_inside(args)
+        return
+
+    if os.getuid() != 0:
+        raise SystemExit('ERROR: creating a network namespace requires root.')
+
+    subprocess.run(['ip', 'netns', 'add', NAMESPACE], check=True)
+    try:
+        subprocess.run(['ip', 'netns', 'exec', NAMESPACE, sys.executable, '-m', 'benchmarks.prewarm', '--inside',
+                        '--rounds', str(args.rounds), '--resolver-delay', str(args.resolver_delay)], check=True)
+    finally:
+        subprocess.run(['ip', 'netns', 'del', NAMESPACE])
+
+
+if __name__ == '__main__':
+    main()
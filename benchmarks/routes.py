@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.routes
+    ~~~~~~~~~~~~~~~~~
+
+    Tunnel bring-up time against the number of split routes, in a throwaway network namespace:
+    the native vpnc-script (one `ip -batch`) versus one `ip route` execution per route, like
+    the vpnc-script from openconnect. Also times a reconnect where a few routes changed.
+
+    Requires root and iproute2. Usage: python -m benchmarks.routes [--counts 100,1000,5000]
+"""
+import os
+import subprocess
+import tempfile
+import time
+from argparse import ArgumentParser
+from typing import Dict, List
+from fortigate_vpn_login import vpnc_script
+
+NAMESPACE = f"fvl-bench-{os.getpid()}"
+
+# not tun0, so the state file doesn't clash with a real session
+DEVICE = 'fvlbench0'
+
+
+def ip(*arguments: str) -> None:
+    subprocess.run(['ip', '-n', NAMESPACE] + list(arguments), check=True)
+
+
+def get_routes(count: int, offset: int = 0) -> List[str]:
+    return [f"10.{(number >> 8) & 0xff}.{number & 0xff}.0" for number in range(offset, offset + count)]
+
+
+def get_env(routes: List[str], reason: str) -> Dict[str, str]:
+    env = dict(os.environ, reason=reason, TUNDEV=DEVICE, INTERNAL_IP4_ADDRESS='10.212.134.200',
+               CISCO_SPLIT_INC=str(len(routes)))
+    for number, route in enumerate(routes):
+        env[f"CISCO_SPLIT_INC_{number}_ADDR"] = route
+        env[f"CISCO_SPLIT_INC_{number}_MASKLEN"] = '24'
+    return env
+
+
+def run_script(routes: List[str], reason: str) -> float:
+    """
+    Returns:
+        float: seconds taken by the native vpnc-script, run like openconnect does
+    """
+    command = ['ip', 'netns', 'exec', NAMESPACE, '/bin/sh', '-c', vpnc_script.get_script_command()]
+    start = time.perf_counter()
+    subprocess.run(command, env=get_env(routes, reason), check=True)
+    return time.perf_counter() - start
+
+
+def run_one_by_one(routes: List[str]) -> float:
+    """
+    Returns:
+        float: seconds taken by one `ip route` execution per route
+    """
+    with tempfile.NamedTemporaryFile('w', suffix='.sh') as fp:
+        fp.write(f"ip link set dev {DEVICE} up\n")
+        fp.writelines(f"ip route replace {route}/24 dev {DEVICE}\n" for route in routes)
+        fp.flush()
+        start = time.perf_counter()
+        subprocess.run(['ip', 'netns', 'exec', NAMESPACE, '/bin/sh', fp.name], check=True)
+        return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = ArgumentParser(description='Tunnel bring-up time against the number of split routes.')
+    parser.add_argument('--counts', default='100,1000,5000', help='route counts (default: 100,1000,5000)')
+    parser.add_argument('--changed', type=float, default=0.01,
+                        help='fraction of the routes replaced on reconnect (default: 0.01)')
+    args = parser.parse_args()
+
+    if os.getuid() != 0:
+        raise SystemExit('ERROR: creating a network namespace requires root.')
+
+    print(f"{'routes':>7} {'one by one':>12} {'batched':>12} {'reconnect':>12}")
+    for count in (int(count) for count in args.counts.split(',')):
+        subprocess.run(['ip', 'netns', 'add', NAMESPACE], check=True)
+        try:
+            ip('tuntap', 'add', 'dev', DEVICE, 'mode', 'tun')
+            routes = get_routes(count)
+            one_by_one = run_one_by_one(routes)
+            ip('route', 'flush', 'dev', DEVICE)
+
+            batched = run_script(routes, 'connect')
+            changed = max(int(count * args.changed), 1)
+            reconnect = run_script(routes[changed:] + get_routes(changed, count), 'reconnect')
+            run_script([], 'disconnect')
+        finally:
+            subprocess.run(['ip', 'netns', 'del', NAMESPACE])
+
+        print(f"{count:>7} {one_by_one * 1000:>10.0f}ms {batched * 1000:>10.0f}ms {reconnect * 1000:>10.0f}ms")
+
+
+if __name__ == '__main__':
+    main()
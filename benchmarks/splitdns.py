@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.splitdns
+    ~~~~~~~~~~~~~~~~~~~
+
+    Lookup latency and cache hit rate of the split DNS forwarder, against stand-in DNS servers:
+    one for the VPN (with the tunnel latency) and one for everything else.
+
+    Usage: python -m benchmarks.splitdns [--queries N] [--names N] [--latency SECONDS]
+"""
+import random
+import statistics
+import time
+from argparse import ArgumentParser
+from fortigate_vpn_login.loadgen import percentile
+from fortigate_vpn_login.splitdns import SplitDNSResolver
+from tests.dns import StandInDNSServer, ask, build_query
+
+
+def main() -> None:
+    parser = ArgumentParser(description='Lookup latency and cache hit rate of the split DNS forwarder.')
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--names', type=int, default=200, help='distinct names queried (default: 200)')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='seconds the VPN DNS server takes to answer (default: 0.05)')
+    parser.add_argument('--local-latency', type=float, default=0.005,
+                        help='seconds the local DNS server takes to answer (default: 0.005)')
+    parser.add_argument('--ttl', type=int, default=300)
+    args = parser.parse_args()
+
+    vpn_server = StandInDNSServer('127.0.0.2', latency=args.latency, ttl=args.ttl)
+    local_server = StandInDNSServer('127.0.0.3', vpn_server.port, latency=args.local_latency, ttl=args.ttl)
+    resolver = SplitDNSResolver([(['corp.example.com'], ['127.0.0.2'])], ['127.0.0.3'], '127.0.0.1', 0,
+                                upstream_port=vpn_server.port)
+    for server in (vpn_server, local_server):
+        server.start()
+    resolver.start()
+
+    # half of the names are under the VPN domain; some names are much more popular than others
+    names = [f"host{number}.corp.example.com" if number % 2 else f"host{number}.example.org"
+             for number in range(args.names)]
+    weights = [1 / (rank + 1) for rank in range(args.names)]
+    random.seed(1)
+
+    latencies = {'vpn': [], 'local': []}
+    for number, name in enumerate(random.choices(names, weights, k=args.queries)):
+        start = time.perf_counter()
+        ask('127.0.0.1', resolver.port, build_query(name, query_id=number % 65536))
+        latencies['vpn' if name.endswith('corp.example.com') else 'local'].append(time.perf_counter() - start)
+
+    resolver.stop()
+    for server in (vpn_server, local_server):
+        server.stop()
+
+    print(f"{args.queries} queries for {args.names} names, VPN DNS latency {args.latency * 1000:.0f} ms, "
+          f"local DNS latency {args.local_latency * 1000:.0f} ms")
+    for route, values in latencies.items():
+        values = sorted(value * 1000 for value in values)
+        print(f"  {route:<5} {len(values):>6} lookups, median {statistics.median(values):7.2f} ms, "
+              f"p95 {percentile(values, 95):7.2f} ms, p99 {percentile(values, 99):7.2f} ms")
+    print(resolver.report())
+
+
+if __name__ == '__main__':
+    main()
@@ -30,3 +30,7 @@ logging.basicConfig(
 )
 logging.getLogger().setLevel(os.getenv("LOG_LEVEL", "FATAL"))
 logger = logging.getLogger(__name__)
+
+# secrets (cookies, auth ids) are redacted from everything that gets emitted
+from fortigate_vpn_login import logs  # noqa: E402
+logs.setup()
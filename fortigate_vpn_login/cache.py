@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+    fortigate_vpn_login.cache
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Persistent per-user cache of resolved addresses, so a new invocation doesn't have to
+    resolve the Fortigate VPN Server hostname again (which can take seconds on captive or
+    slow resolvers).
+
+    `getaddrinfo()` doesn't expose the TTL of the DNS records, so addresses are kept for the
+    configured TTL instead, even if the record changes meanwhile. A cached address that stops
+    answering is resolved again right away.
+"""
+import json
+import os
+import socket
+import time
+from pathlib import Path
+from typing import Dict, Optional, Type
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from fortigate_vpn_login import logger
+
+
+class Cache(object):
+    """
+    Resolved addresses with their expiration time, stored as JSON.
+    """
+    def __init__(self, filename: Path, ttl: int = 300) -> None:
+        """
+        Creates the cache and loads it from `filename`, if it exists.
+
+        Args:
+            filename (Path): file where the cache is persisted
+            ttl (int): seconds for which a resolved address is valid
+        """
+        self.filename = filename
+        self.ttl = ttl
+        self.addresses: Dict[str, Dict] = {}
+        self.changed = False
+        self.load()
+
+    def load(self) -> bool:
+        """
+        Loads the cache from file, discarding expired entries.
+
+        Returns:
+            bool: True if load was successful. False if not.
+        """
+        try:
+            with open(self.filename, 'r') as fp:
+                data = json.load(fp)
+        except (OSError, ValueError) as e:
+            logger.debug("Could not load cache file %s: %s", self.filename, e)
+            return False
+
+        now = time.time()
+        self.addresses = {host: entry for host, entry in data.get('addresses', {}).items()
+                          if entry.get('expires', 0) > now}
+        return True
+
+    def write(self) -> bool:
+        """
+        Persists the cache into a file, if anything changed since it was loaded.
+
+        Returns:
+            bool: True if the save was successful (or not needed). False if not.
+        """
+        if not self.changed:
+            return True
+
+        try:
+            os.makedirs(Path(self.filename).parent, mode=0o700, exist_ok=True)
+            temp_filename = f"{self.filename}.{os.getpid()}"
+            with open(os.open(temp_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as fp:
+                json.dump({'addresses': self.addresses}, fp)
+            os.replace(temp_filename, self.filename)
+        except OSError as e:
+            logger.debug("Could not write cache file %s: %s", self.filename, e)
+            return False
+
+        self.changed = False
+        return True
+
+    def get_address(self, host: str) -> Optional[str]:
+        """
+        Gets a cached address for a host.
+
+        Returns:
+            str|Optional: the address, or None if not cached or expired
+        """
+        entry = self.addresses.get(host)
+        if entry and entry['expires'] > time.time():
+            return entry['address']
+
+        return None
+
+    def set_address(self, host: str, address: str, family: int = socket.AF_INET) -> None:
+        """
+        Caches the address of a host for `ttl` seconds.
+
+        Args:
+            host (str): hostname
+            address (str): IPv4 or IPv6 address of the host
+            family (int): address family of `address`, `socket.AF_INET` or `socket.AF_INET6`
+        """
+        self.addresses[host] = {'address': address, 'family': int(family), 'expires': time.time() + self.ttl}
+        self.changed = True
+
+    def forget(self, host: str) -> None:
+        """
+        Removes a host from the cache, e.g. when its cached address doesn't answer anymore.
+        """
+        if self.addresses.pop(host, None):
+            self.changed = True
+
+    def resolve(self, host: str, port: int) -> str:
+        """
+        Gets the address of a host from the cache, resolving and caching it if needed.
+
+        Args:
+            host (str): hostname
+            port (int): port number, used on the name resolution
+
+        Returns:
+            str: the address of the host
+        """
+        address = self.get_address(host)
+        if address:
+            logger.debug("Cached address for %s: %s", host, address)
+            return address
+
+        # the first address, in the order preferred by the system (RFC 6724), IPv4 or IPv6
+        family, _, _, _, sockaddr = socket.getaddrinfo(host, port, socket.AF_UNSPEC, socket.SOCK_STREAM)[0]
+        address = sockaddr[0]
+        logger.debug("Resolved address for %s: %s", host, address)
+        self.set_address(host, address, family)
+        return address
+
+
+def _cached_connection(base: Type[HTTPConnection], cache: Cache) -> Type[HTTPConnection]:
+    """
+    Creates a connection class which connects to the cached address of the host. Only the socket
+    goes to the address: the `Host` header, SNI and certificate validation still use the hostname.
+    """
+    class CachedConnection(base):
+        def _new_conn(self):
+            host = self._dns_host
+            cached = cache.get_address(host) is not None
+            try:
+                self._dns_host = cache.resolve(host, self.port)
+            except OSError:
+                # let urllib3 report the resolution error
+                return super()._new_conn()
+
+            try:
+                return super()._new_conn()
+            except Exception:
+                cache.forget(host)
+                if not cached:
+                    raise
+                logger.debug("Cached address for %s failed, resolving it again", host)
+                self._dns_host = cache.resolve(host, self.port)
+                return super()._new_conn()
+            finally:
+                self._dns_host = host
+
+    return CachedConnection
+
+
+class CachedResolverAdapter(HTTPAdapter):
+    """
+    Transport adapter for `requests` which resolves hostnames through a `Cache`.
+    """
+    def __init__(self, cache: Cache, **kwargs) -> None:
+        self.cache = cache
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super().init_poolmanager(*args, **kwargs)
+
+        class CachedHTTPConnectionPool(HTTPConnectionPool):
+            ConnectionCls = _cached_connection(HTTPConnection, self.cache)
+
+        class CachedHTTPSConnectionPool(HTTPSConnectionPool):
+            ConnectionCls = _cached_connection(HTTPSConnection, self.cache)
+
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CachedHTTPConnectionPool,
+            'https': CachedHTTPSConnectionPool,
+        }
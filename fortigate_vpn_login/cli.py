@@ -10,12 +10,31 @@ import os
 import sys
 import webbrowser
 import subprocess
-from argparse import ArgumentParser, RawDescriptionHelpFormatter
+import time
+from pathlib import Path
+from argparse import ArgumentParser, Namespace, RawDescriptionHelpFormatter
+from typing import Optional
 from fortigate_vpn_login import __version__, __description__, logger
-from fortigate_vpn_login import utils, config
+from fortigate_vpn_login import utils, config, dpd, logs, profiling, splitdns, loadgen, vpnc_script, netwatch
+from fortigate_vpn_login.cache import Cache
 from fortigate_vpn_login.fortigate import Fortigate
 import fortigate_vpn_login.webserver as webserver
 
+# with --watch, openconnect exiting faster than this is an error (like an invalid cookie), not a drop
+WATCH_MIN_SESSION = 30
+
+# with --watch, seconds between attempts to reach the server when the network doesn't change
+WATCH_RETRY_MIN = 5
+WATCH_RETRY_MAX = 60
+
+# with --watch, seconds openconnect keeps trying to bring the tunnel back after a network change
+# (300 by default), so the login warmed up on that change hasn't expired when it gives up
+WATCH_RECONNECT_TIMEOUT = 30
+
+# with --watch, for how long after a network change the warmed up login is kept fresh: the tunnel
+# may only notice it's dead on its next dead peer detection, then it tries to reconnect
+WATCH_REFRESH_WINDOW = dpd.MAX_INTERVAL + WATCH_RECONNECT_TIMEOUT
+
 
 def main() -> int:
     """
@@ -68,6 +87,78 @@ def main() -> int:
         dest='FORTI_URL'
     )
 
+    parser.add_argument(
+        '--dpd-stats',
+        help='Show the learned dead peer detection intervals and the drop and wakeup metrics per network.',
+        dest='DPD_STATS',
+        action='store_true'
+    )
+
+    parser.add_argument(
+        '--loadgen',
+        help='Capacity test: instead of connecting, send requests to the SAML endpoints of the server and '
+             'report the throughput, latency and errors.',
+        dest='LOADGEN',
+        action='store_true'
+    )
+
+    parser.add_argument(
+        '--loadgen-requests',
+        help='Total number of requests for --loadgen (default: 100).',
+        dest='LOADGEN_REQUESTS',
+        metavar='N',
+        type=int,
+        default=100
+    )
+
+    parser.add_argument(
+        '--loadgen-concurrency',
+        help='Maximum number of concurrent requests for --loadgen (default: 10).',
+        dest='LOADGEN_CONCURRENCY',
+        metavar='N',
+        type=int,
+        default=10
+    )
+
+    parser.add_argument(
+        '--loadgen-rate',
+        help='Requests per second for --loadgen (default: unlimited).',
+        dest='LOADGEN_RATE',
+        metavar='N',
+        type=float
+    )
+
+    parser.add_argument(
+        '--loadgen-endpoints',
+        help=f"Comma separated endpoints for --loadgen (default: {','.join(loadgen.ENDPOINTS)}).",
+        dest='LOADGEN_ENDPOINTS',
+        default=','.join(loadgen.ENDPOINTS)
+    )
+
+    parser.add_argument(
+        '--profile',
+        help='Profile the whole login workflow with cProfile, writing the result to this file. '
+             'The callback listener process is written to <file>.callback.',
+        dest='PROFILE',
+        metavar='FILE'
+    )
+
+    parser.add_argument(
+        '--profile-format',
+        help='Output format for --profile: pstats (default) or collapsed stacks for flame graphs.',
+        dest='PROFILE_FORMAT',
+        choices=profiling.PROFILE_FORMATS,
+        default='pstats'
+    )
+
+    parser.add_argument(
+        '--trace-malloc',
+        help='Show the top N memory allocators (tracemalloc) at the end of each login phase.',
+        dest='TRACE_MALLOC',
+        metavar='N',
+        type=int
+    )
+
     # windows don't have these options supported
     if not utils.is_windows():
         parser.add_argument(
@@ -87,14 +178,39 @@ def main() -> int:
             default=True
         )
 
+        parser.add_argument(
+            '--watch',
+            help='Keep the VPN connected: log in again when the tunnel dies, warming up the login as soon as '
+                 'the network changes (e.g. switching Wi-Fi or waking up). Requires --foreground (Linux only).',
+            dest="WATCH",
+            action='store_true'
+        )
+
+        parser.add_argument(
+            '--native-script',
+            help='Use the routing script from this package instead of the vpnc-script from openconnect. '
+                 'Routes are installed in a single batch, and reconnects only change what changed (Linux only).',
+            dest="NATIVE_SCRIPT",
+            action='store_true'
+        )
+
+        parser.add_argument(
+            '--split-dns',
+            help='Run a local caching DNS forwarder for the VPN domains, registered with the system resolver '
+                 'through the routing script from this package (see --native-script). Requires --foreground '
+                 '(Linux only).',
+            dest="SPLIT_DNS",
+            action='store_true'
+        )
+
     # parse the arguments, show in the screen if needed, etc
     parser = parser.parse_args()
 
     if parser.DEBUG_MODE:
         logger.setLevel("DEBUG")
         logging.getLogger().setLevel(os.getenv("LOG_LEVEL", "DEBUG"))
-        # TODO: on debug mode, change log format to
-        # '[%(asctime)s] [%(levelname)s] [%(name)s:%(filename)s:%(lineno)s: %(funcName)s()] %(message)s'))
+        # structured records on debug mode, which are easier to filter and to attach to bug reports
+        logs.setup(json_format=True)
     else:
         # defaults to info
         logger.setLevel("INFO")
@@ -106,100 +222,338 @@ def main() -> int:
     if parser.FOREGROUND:
         parser.BACKGROUND = False
 
+    profiler = None
+    if parser.PROFILE:
+        profiler = profiling.Profiler(parser.PROFILE, parser.PROFILE_FORMAT)
+        profiler.start()
+
+    malloc_tracer = None
+    if parser.TRACE_MALLOC:
+        malloc_tracer = profiling.MallocTracer(parser.TRACE_MALLOC)
+        malloc_tracer.start()
+
+    try:
+        return run(parser, profiler)
+    finally:
+        if malloc_tracer:
+            malloc_tracer.stop()
+        if profiler:
+            profiler.stop()
+
+
+def run(args: Namespace, profiler: Optional[profiling.Profiler] = None) -> int:
+    """
+    Runs the login workflow, from the configuration to openconnect. Each step is wrapped in a
+    `profiling.phase()`, so hooks registered with `profiling.add_hook()` are notified.
+
+    Args:
+        args (Namespace): parsed command line arguments
+        profiler (Profiler|Optional): profiler used for the whole workflow, if any. The callback
+            listener process gets its own profile based on this one.
+
+    Returns:
+        int: The status from the program, see `main()`.
+    """
     # load configuration
-    options = config.Config()
+    with profiling.phase('config'):
+        options = config.Config()
 
     # do we need to configure interactively?
-    if parser.INTERACTIVE_CONFIGURE:
+    if args.INTERACTIVE_CONFIGURE:
         options.configure()
         options.write()
         return 0
 
-    openconnect_path = utils.find_openconnect()
+    if args.LOADGEN:
+        return run_loadgen(args, options)
+
+    if args.DPD_STATS:
+        print(dpd.DPDTuner(Path(options.config_filename).parent / 'dpd.json').report())
+        return 0
+
+    if getattr(args, 'SPLIT_DNS', False) and args.BACKGROUND:
+        print('ERROR: "--split-dns" only works together with "--foreground".')
+        return 2
+
+    # the native vpnc-script (which also registers the split DNS forwarder) relies on Linux tools,
+    # and the network watcher on netlink
+    if not sys.platform.startswith('linux'):
+        linux_only = (('--native-script', 'NATIVE_SCRIPT'), ('--split-dns', 'SPLIT_DNS'), ('--watch', 'WATCH'))
+        for option, dest in linux_only:
+            if getattr(args, dest, False):
+                print(f'ERROR: "{option}" is only supported on Linux.')
+                return 2
+
+    watch = getattr(args, 'WATCH', False)
+    if watch and args.BACKGROUND:
+        print('ERROR: "--watch" only works together with "--foreground".')
+        return 2
+
+    with profiling.phase('openconnect_check'):
+        openconnect_path = utils.find_openconnect()
+        compatible = utils.check_openconnect_version(openconnect_path)
 
     # openconnect compatability check
-    if not utils.check_openconnect_version(openconnect_path):
+    if not compatible:
         print("ERROR: Your openconnect version isn't compatible with this program. "
               "Make sure you have the latest version, which supports the \"fortinet\" protocol.")
         return 1
 
     # server url
-    if not parser.FORTI_URL:
+    if not args.FORTI_URL:
         fortigate_vpn_url = options.get('forti_url')
         if not fortigate_vpn_url:
             print('ERROR: "forti_url" option is not set. Use "-s" or "--configure" to set it.')
             return 2
     else:
-        fortigate_vpn_url = parser.FORTI_URL
+        fortigate_vpn_url = args.FORTI_URL
+
+    # persistent cache of resolved addresses between invocations
+    cache = None
+    if options.getboolean('dns_cache'):
+        cache = Cache(Path(options.config_filename).parent / 'cache.json', options.getint('dns_cache_ttl') or 300)
 
     # establish connection to the Fortigate VPN Server, grab info, etc
-    fortigate = Fortigate(fortigate_vpn_url)
-    url = fortigate.connect_saml()
+    fortigate = Fortigate(fortigate_vpn_url, cache)
+
+    try:
+        if not watch:
+            return connect(args, options, fortigate, openconnect_path, profiler)
+
+        # keep the VPN connected, warming up the next login as soon as the network changes
+        prewarmer = netwatch.Prewarmer(fortigate, profiler)
+        try:
+            with netwatch.NetworkWatcher() as watcher:
+                while True:
+                    status = connect(args, options, fortigate, openconnect_path, profiler, watcher, prewarmer)
+                    if status != 0:
+                        return status
+
+                    print("VPN disconnected. Reconnecting as soon as the server is reachable.")
+                    wait_for_server(prewarmer, watcher)
+        finally:
+            prewarmer.close()
+
+    except KeyboardInterrupt:
+        logger.debug("User interrupted process.")
+        print("CTRL+C/SIGTERM detected. Exiting.")
+
+    return 0
+
+
+def wait_for_server(prewarmer: netwatch.Prewarmer, watcher: netwatch.NetworkWatcher) -> None:
+    """
+    Blocks until the next login is warmed up. It may still be warm from a network change while the
+    VPN was connected. Otherwise, if the server can't be reached, it's tried again on the next network
+    change or, as the server may be down for reasons unrelated to this host, after a growing delay.
+
+    Args:
+        prewarmer (Prewarmer): warms up the next login
+        watcher (NetworkWatcher): notifies the network changes
+    """
+    retry = WATCH_RETRY_MIN
+    while not prewarmer.warm and not prewarmer.prewarm():
+        if watcher.wait(retry):
+            retry = WATCH_RETRY_MIN
+        else:
+            retry = min(retry * 2, WATCH_RETRY_MAX)
+
+
+def connect(args: Namespace, options: config.Config, fortigate: Fortigate, openconnect_path: Path,
+            profiler: Optional[profiling.Profiler] = None, watcher: Optional[netwatch.NetworkWatcher] = None,
+            prewarmer: Optional[netwatch.Prewarmer] = None) -> int:
+    """
+    Logs in through the SAML workflow and runs openconnect with the cookie.
+
+    Args:
+        args (Namespace): parsed command line arguments
+        options (Config): the loaded configuration
+        fortigate (Fortigate): the server connection
+        openconnect_path (Path): path of the openconnect executable
+        profiler (Profiler|Optional): profiler for the callback listener process, if any
+        watcher (NetworkWatcher|Optional): if set, network changes while the VPN is connected
+            warm up the next login through `prewarmer`
+        prewarmer (Prewarmer|Optional): the callback listener it started, if any, is used here
+
+    Returns:
+        int: The status from the program, see `main()`.
+    """
+    split_dns = getattr(args, 'SPLIT_DNS', False)
+    split_dns_port = options.getint('split_dns_port') or 10053
+
+    # only openconnect runs through sudo: fail before the login, instead of wasting its cookie
+    if split_dns and splitdns.is_privileged_port(split_dns_port) and os.getuid() != 0:
+        print(f"ERROR: split_dns_port = {split_dns_port} requires running fortigate-vpn-login as root.")
+        return 1
+
+    # the vpnc-script replaces the system resolvers, so grab them before connecting
+    local_nameservers = splitdns.get_local_nameservers() if split_dns else []
+
+    ws = prewarmer.take_webserver() if prewarmer else None
+    with profiling.phase('connect_saml'):
+        url = fortigate.connect_saml()
+    if fortigate.cache:
+        fortigate.cache.write()
     if not url:
+        if ws:
+            webserver.quit(ws)
         return 1
 
     # webserver to get the response from the IDP through browser request
-    ws = webserver.run()
-    webbrowser.open(url)
-    auth_id = webserver.return_token()
-    webserver.quit(ws)
+    with profiling.phase('callback'):
+        if ws is None:
+            ws = webserver.run(profiler.for_process('callback') if profiler else None)
+        webbrowser.open(url)
+        auth_id = webserver.return_token()
+        webserver.quit(ws)
 
     if auth_id == '-1':
         print("ERROR: Invalid ID from provider. Try again or contact your provider support.")
         return 1
 
-    cookie_svpn = fortigate.get_cookie(auth_id)
+    with profiling.phase('get_cookie'):
+        cookie_svpn = fortigate.get_cookie(auth_id)
+
+    resolver = None
+    if split_dns:
+        with profiling.phase('split_dns'):
+            json_config = fortigate.get_json_config()
+            routes = splitdns.get_vpn_routes(json_config)
+            if routes:
+                # by default on the tunnel address: systemd-resolved sends the queries for the
+                # tunnel device through it
+                resolver = splitdns.SplitDNSResolver(
+                    routes,
+                    local_nameservers,
+                    options.get('split_dns_address') or splitdns.get_assigned_address(json_config) or '127.0.0.1',
+                    split_dns_port
+                )
+                try:
+                    resolver.start()
+                except OSError as e:
+                    print(f"ERROR: Could not listen on {resolver.address}:{resolver.port} for split DNS: "
+                          f"{e.strerror}. Check split_dns_address and split_dns_port in the configuration file.")
+                    return 1
+
+        if resolver:
+            print(f"Split DNS resolver listening on {resolver.address}:{resolver.port}")
+        else:
+            print("The VPN server didn't send any DNS domains, not using split DNS.")
 
-    openconnect_arguments = [
-        "--protocol=fortinet",
-        f"--server={fortigate_vpn_url}",
-        f"--useragent=fortigate-vpn-login-{__version__}:{os.uname().version}",
-        "--no-dtls",
-        "--non-inter",
-        "--disable-ipv6",
-        f"--cookie=SVPNCOOKIE={cookie_svpn}",
-    ]
+    openconnect_arguments = utils.get_openconnect_arguments(fortigate.url, cookie_svpn)
+    if watcher is not None:
+        openconnect_arguments.append(f"--reconnect-timeout={WATCH_RECONNECT_TIMEOUT}")
 
-    if parser.QUIET_MODE:
+    # dead peer detection tuned to the NAT idle timeout learned for this network
+    tuner = None
+    if options.getboolean('adaptive_dpd'):
+        tuner = dpd.DPDTuner(Path(options.config_filename).parent / 'dpd.json')
+        network = dpd.get_network_id()
+        openconnect_arguments.append(f"--force-dpd={tuner.get_interval(network)}")
+
+    # the native script also registers the split DNS forwarder with the system resolver
+    if getattr(args, 'NATIVE_SCRIPT', False) or resolver:
+        script_env = resolver.get_script_environment() if resolver else None
+        openconnect_arguments.append(f"--script={vpnc_script.get_script_command(script_env)}")
+
+    if args.QUIET_MODE:
         openconnect_arguments.append("--quiet")
 
-    if parser.DEBUG_MODE:
+    if args.DEBUG_MODE:
         openconnect_arguments.append("--verbose")
 
-    if parser.BACKGROUND:
+    if args.BACKGROUND:
         openconnect_arguments.append("--quiet")
         openconnect_arguments.append("--background")
 
-    command_line = []
-    if utils.is_windows():
-        workdir = openconnect_path.parent
-        command_line = [
-            "powershell",
-            "-Command",
-            f"Start-Process '{str(openconnect_path)}' "
-            f"-ArgumentList {','.join(openconnect_arguments)} "
-            f"-Verb runAs -WorkingDirectory {workdir}",
-        ]
-    else:
-        if not os.getuid() == 0:
-            command_line.append("sudo")
-            command_line = command_line + [str(openconnect_path)] + openconnect_arguments
+    command_line = utils.get_openconnect_command(openconnect_path, openconnect_arguments)
 
     env = os.environ.copy()
     env['LC_ALL'] = 'C'
 
+    started = time.monotonic()
+    returncode = None
+    network_changed = False
     try:
-        if not parser.BACKGROUND:
-            subprocess.run(command_line, env=env)
+        with profiling.phase('openconnect'):
+            if args.BACKGROUND:
+                subprocess.run(command_line, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            elif watcher is None:
+                returncode = subprocess.run(command_line, env=env).returncode
+            else:
+                refresh_until = refresh_at = 0.0
+                with subprocess.Popen(command_line, env=env) as process:
+                    while process.poll() is None:
+                        if watcher.wait(1):
+                            logger.info("Network changed, warming up the next login.")
+                            network_changed = True
+                            prewarmer.prewarm()
+                            refresh_until = time.monotonic() + WATCH_REFRESH_WINDOW
+                            refresh_at = time.monotonic() + WATCH_RETRY_MIN
+                        elif refresh_at <= time.monotonic() < refresh_until and not prewarmer.warm:
+                            logger.debug("Warming up the next login again, it expired or failed")
+                            prewarmer.prewarm()
+                            refresh_at = time.monotonic() + WATCH_RETRY_MIN
+                returncode = process.returncode
+    finally:
+        if resolver:
+            resolver.stop()
+            print(resolver.report())
+
+    # in background, openconnect outlives us and we can't tell whether the session dropped; a session
+    # that failed before getting established isn't taken as a drop by the tuner. After a network
+    # change (roaming, suspend), the tunnel dying says nothing about the NAT of the first network.
+    if tuner and returncode is not None:
+        if network_changed or dpd.get_network_id() != network:
+            logger.debug("Network changed during the session, not learning the DPD interval from it")
         else:
-            subprocess.run(command_line, env=env,
-                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    except KeyboardInterrupt:
-        logger.debug("User interrupted process.")
-        print("CTRL+C/SIGTERM detected. Exiting.")
+            tuner.record(network, time.monotonic() - started, dropped=returncode != 0)
+            tuner.write()
+            logger.info("DPD: %s", tuner.report(network))
+
+    if watcher is not None and time.monotonic() - started < WATCH_MIN_SESSION:
+        print(f"ERROR: openconnect exited in less than {WATCH_MIN_SESSION} seconds, not reconnecting.")
+        return 1
 
     return 0
 
 
+def run_loadgen(args: Namespace, options: config.Config) -> int:
+    """
+    Runs the load generator against the Fortigate VPN Server and prints its report.
+
+    Args:
+        args (Namespace): parsed command line arguments
+        options (Config): the loaded configuration
+
+    Returns:
+        int: 0 if at least one request succeeded, 1 if not, 2 on usage errors.
+    """
+    fortigate_vpn_url = args.FORTI_URL or options.get('forti_url')
+    if not fortigate_vpn_url:
+        print('ERROR: "forti_url" option is not set. Use "-s" or "--configure" to set it.')
+        return 2
+
+    try:
+        generator = loadgen.LoadGenerator(
+            fortigate_vpn_url,
+            requests_count=args.LOADGEN_REQUESTS,
+            concurrency=args.LOADGEN_CONCURRENCY,
+            rate=args.LOADGEN_RATE,
+            endpoints=[endpoint.strip() for endpoint in args.LOADGEN_ENDPOINTS.split(',') if endpoint.strip()]
+        )
+    except ValueError as e:
+        print(f"ERROR: {e}.")
+        return 2
+
+    print(f"Sending {args.LOADGEN_REQUESTS} requests to {fortigate_vpn_url}...")
+    with profiling.phase('loadgen'):
+        report = generator.run()
+    print(report)
+
+    return 1 if report.failed == report.total else 0
+
+
 if __name__ == "__main__":
     sys.exit(main())
@@ -31,7 +31,12 @@ class Config(object):
         'quiet_mode': "True",
         'config_filename': utils.get_default_config_filepath() / 'config.ini',
         'openconnect_pid_filename': '/var/run/openconnect.pid',
-        'forti_url': ""
+        'forti_url': "",
+        'dns_cache': "False",
+        'dns_cache_ttl': "300",
+        'split_dns_address': "",
+        'split_dns_port': "10053",
+        'adaptive_dpd': "False"
     }
 
     def __init__(self, name: Optional[str] = None, **kwargs: str) -> None:
@@ -48,7 +53,7 @@ class Config(object):
                 case there are multiples instances of it.
         """
         self.name = name or self.__class__.__name__.lower()
-        logger.debug(f"Initializing configuration ({self.name})")
+        logger.debug("Initializing configuration (%s)", self.name)
         self.config = configparser.ConfigParser()
 
         # set defaults
@@ -67,7 +72,7 @@ class Config(object):
         # set from instancing
         for key, value in kwargs.items():
             if key in self.CONFIG:
-                logger.debug(f"Setting option from instance: {key}={value}")
+                logger.debug("Setting option from instance: %s=%s", key, value)
                 self.config['main'][key] = value
 
     def configure(self) -> None:
@@ -99,10 +104,10 @@ class Config(object):
             bool: True if the save was successful. False if not.
         """
         try:
-            logger.debug(f"Creating directories for file {self.config_filename}")
+            logger.debug("Creating directories for file %s", self.config_filename)
             os.makedirs(Path(self.config_filename).parent, mode=0o700, exist_ok=True)
 
-            logger.debug(f"Writing configuration to file {self.config_filename}")
+            logger.debug("Writing configuration to file %s", self.config_filename)
             with open(self.config_filename, 'w') as fp:
                 self.config.write(fp)
             os.chmod(self.config_filename, 0o0600)
@@ -126,7 +131,7 @@ class Config(object):
         Returns:
             bool: True if load was successful. False if not.
         """
-        logger.debug(f"Loading configuration file {self.config_filename}")
+        logger.debug("Loading configuration file %s", self.config_filename)
         self.config.read(self.config_filename)
 
     def has_option(self, option: str) -> bool:
@@ -171,6 +176,21 @@ class Config(object):
         except (configparser.NoOptionError, ValueError):
             return None
 
+    def getint(self, option: str) -> Optional[int]:
+        """
+        Gets an option from the configuration, as an integer. Option must be one in `CONFIG` class parameter.
+
+        Returns:
+            int|Optional: the option integer value
+        """
+        try:
+            if option in self.CONFIG:
+                return self.config.getint('main', option)
+            else:
+                return None
+        except (configparser.NoOptionError, ValueError):
+            return None
+
     def set(self, option: str, value: str) -> None:
         """
         Sets an option on the configuration. Option must be one in `CONFIG` class parameter.
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+    fortigate_vpn_login.dpd
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Adaptive dead peer detection. NAT devices silently expire idle tunnel mappings, and each
+    drop costs a full login. The DPD interval passed to openconnect (which also keeps the
+    mapping alive) is learned per network from the sessions that dropped: it's halved after a
+    drop and slowly raised again, while staying below the interval that dropped, to save
+    wakeups (and battery). That limit is forgotten after a run of stable sessions, since the
+    drop may have had another cause.
+"""
+import json
+import os
+import socket
+import struct
+from pathlib import Path
+from typing import Dict, Optional
+from fortigate_vpn_login import logger
+
+DEFAULT_INTERVAL = 60
+MIN_INTERVAL = 10
+MAX_INTERVAL = 300
+
+# a session without drops must last this many intervals to raise the interval
+STABLE_INTERVALS = 20
+
+# how much the interval grows after a stable session
+INCREASE_FACTOR = 1.25
+
+# how far below the lowest interval that dropped we stay
+CEILING_MARGIN = 0.9
+
+# stable sessions in a row after which the lowest interval that dropped is probed again
+CEILING_PROBE_SESSIONS = 10
+
+
+def get_network_id() -> str:
+    """
+    Identifies the current network by its default gateway: its address and, when known, its
+    MAC address (so two networks with the same 192.168.0.1 gateway are told apart).
+
+    Returns:
+        str: the network id, or `default` when it can't be found
+    """
+    gateway = None
+    try:
+        with open('/proc/net/route', 'r') as fp:
+            for line in fp.readlines()[1:]:
+                fields = line.split()
+                if len(fields) > 2 and fields[1] == '00000000' and fields[2] != '00000000':
+                    gateway = socket.inet_ntoa(struct.pack('<L', int(fields[2], 16)))
+                    break
+    except OSError as e:
+        logger.debug("Could not read the routing table: %s", e)
+
+    if not gateway:
+        return 'default'
+
+    try:
+        with open('/proc/net/arp', 'r') as fp:
+            for line in fp.readlines()[1:]:
+                fields = line.split()
+                if len(fields) > 3 and fields[0] == gateway:
+                    return f"{gateway}/{fields[3]}"
+    except OSError as e:
+        logger.debug("Could not read the ARP table: %s", e)
+
+    return gateway
+
+
+class DPDTuner(object):
+    """
+    Learned DPD intervals and drop metrics per network, persisted as JSON.
+    """
+    def __init__(self, filename: Path) -> None:
+        """
+        Args:
+            filename (Path): file where the learned values are persisted
+        """
+        self.filename = filename
+        self.networks: Dict[str, Dict] = {}
+        self.load()
+
+    def load(self) -> bool:
+        """
+        Loads the learned values from file.
+
+        Returns:
+            bool: True if load was successful. False if not.
+        """
+        try:
+            with open(self.filename, 'r') as fp:
+                self.networks = json.load(fp).get('networks', {})
+        except (OSError, ValueError) as e:
+            logger.debug("Could not load DPD file %s: %s", self.filename, e)
+            return False
+
+        return True
+
+    def write(self) -> bool:
+        """
+        Persists the learned values into a file.
+
+        Returns:
+            bool: True if the save was successful. False if not.
+        """
+        try:
+            os.makedirs(Path(self.filename).parent, mode=0o700, exist_ok=True)
+            temp_filename = f"{self.filename}.{os.getpid()}"
+            with open(os.open(temp_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as fp:
+                json.dump({'networks': self.networks}, fp)
+            os.replace(temp_filename, self.filename)
+        except OSError as e:
+            logger.debug("Could not write DPD file %s: %s", self.filename, e)
+            return False
+
+        return True
+
+    def _network(self, network: str) -> Dict:
+        return self.networks.setdefault(network, {
+            'interval': DEFAULT_INTERVAL,
+            'ceiling': None,
+            'stable': 0,
+            'sessions': 0,
+            'drops': 0,
+            'uptime': 0.0,
+            'wakeups': 0,
+        })
+
+    def get_interval(self, network: str) -> int:
+        """
+        Gets the DPD interval to be used on a network.
+
+        Args:
+            network (str): the network id, from `get_network_id()`
+
+        Returns:
+            int: the interval in seconds
+        """
+        return self._network(network)['interval']
+
+    def record(self, network: str, duration: float, dropped: bool) -> int:
+        """
+        Learns from a finished session. A session which ended before its first DPD was never
+        established (e.g. a rejected cookie), so it doesn't count as a drop.
+
+        Args:
+            network (str): the network id, from `get_network_id()`
+            duration (float): how long the session lasted, in seconds
+            dropped (bool): True if the session ended without the user asking for it
+
+        Returns:
+            int: the interval for the next session
+        """
+        state = self._network(network)
+        interval = state['interval']
+        dropped = dropped and duration > interval
+
+        state['sessions'] += 1
+        state['uptime'] += duration
+        state['wakeups'] += int(duration / interval)
+
+        if dropped:
+            state['drops'] += 1
+            # the mapping expired before the next DPD: the timeout is below this interval
+            state['ceiling'] = min(state['ceiling'] or interval, interval)
+            state['interval'] = max(MIN_INTERVAL, int(interval / 2))
+            state['stable'] = 0
+        elif duration >= interval * STABLE_INTERVALS:
+            state['stable'] = state.get('stable', 0) + 1
+            if state['ceiling'] and state['stable'] >= CEILING_PROBE_SESSIONS:
+                logger.debug("DPD on %s: probing above %ss again", network, state['ceiling'])
+                state['ceiling'] = None
+                state['stable'] = 0
+            limit = MAX_INTERVAL
+            if state['ceiling']:
+                limit = min(limit, int(state['ceiling'] * CEILING_MARGIN))
+            state['interval'] = max(interval, min(limit, int(interval * INCREASE_FACTOR)))
+
+        logger.debug("DPD on %s: session of %.0fs, dropped: %s, interval %s -> %s",
+                     network, duration, dropped, interval, state['interval'])
+        return state['interval']
+
+    def report(self, network: Optional[str] = None) -> str:
+        """
+        Returns:
+            str: interval, drop rate and wakeup metrics of one network, or all of them
+        """
+        networks = [network] if network else sorted(self.networks)
+        lines = []
+        for name in networks:
+            state = self._network(name)
+            hours = state['uptime'] / 3600
+            drop_rate = state['drops'] / hours if hours else 0
+            wakeup_rate = state['wakeups'] / hours if hours else 3600 / state['interval']
+            lines.append(
+                f"{name}: interval {state['interval']}s, {state['sessions']} sessions, {hours:.1f}h up, "
+                f"{state['drops']} drops ({drop_rate:.2f}/h), {wakeup_rate:.0f} wakeups/h"
+            )
+
+        return "\n".join(lines) if lines else "No sessions recorded yet."
@@ -8,25 +8,53 @@
 import requests
 import xmltodict
 import re
+import time
+from urllib.parse import urlparse
 from bs4 import BeautifulSoup
 from typing import Optional
-from fortigate_vpn_login import logger
+from fortigate_vpn_login import logger, logs
+from fortigate_vpn_login.cache import Cache, CachedResolverAdapter
 
 
 class Fortigate(object):
     """
     Represents a Fortigate VPN Server connection
     """
-    def __init__(self, url: str) -> None:
+    SAML_START_PATH = '/remote/saml/start?redirect=1'
+    SAML_AUTH_ID_PATH = '/remote/saml/auth_id'
+    XML_CONFIG_PATH = '/remote/fortisslvpn_xml'
+
+    # seconds for which a SAML redirect URL fetched by `prewarm()` is still used
+    PREWARM_MAX_AGE = 120
+
+    def __init__(self, url: str, cache: Optional[Cache] = None) -> None:
         """
-        Creates a connection with a Fortigate VPN Server
+        Creates a connection with a Fortigate VPN Server. All requests share the same HTTP session,
+        so the connection (and its TLS session) is reused between them.
 
         Args:
             url (str): The URL of the fortigate vpn server.
+            cache (Cache|Optional): if set, hostnames are resolved through this persistent cache.
         """
         self.xml_config = None
         self.json_config = None
         self.url = url
+        self.cache = cache
+        self.session = requests.Session()
+        self.prewarmed_url = None
+        self.prewarmed_at = 0.0
+
+        if cache is not None:
+            adapter = CachedResolverAdapter(cache)
+            self.session.mount('https://', adapter)
+            self.session.mount('http://', adapter)
+
+    @property
+    def prewarmed(self) -> bool:
+        """
+        True if the next `connect_saml()` returns the URL fetched by `prewarm()` right away.
+        """
+        return bool(self.prewarmed_url) and time.monotonic() - self.prewarmed_at < self.PREWARM_MAX_AGE
 
     def connect_saml(self) -> Optional[str]:
         """
@@ -35,9 +63,14 @@ class Fortigate(object):
         Returns:
             str|Optional: The URL that the user should be redirected to continue the SAML workflow.
         """
+        if self.prewarmed:
+            logger.debug('Using the SAML redirect URL from prewarm')
+            url, self.prewarmed_url = self.prewarmed_url, None
+            return url
+
         try:
-            logger.debug(f"Requesting: {self.url}/remote/saml/start?redirect=1")
-            response = requests.get(url=f"{self.url}/remote/saml/start?redirect=1", timeout=10)
+            logger.debug("Requesting: %s%s", self.url, self.SAML_START_PATH)
+            response = self.session.get(url=f"{self.url}{self.SAML_START_PATH}", timeout=10)
 
         except requests.exceptions.MissingSchema as e:
             print(f"ERROR: Invalid forti_url option: {self.url}, should be something like: "
@@ -48,17 +81,47 @@ class Fortigate(object):
         except requests.exceptions.ConnectionError as e:
             print(f"ERROR: Connection error while requesting server {self.url}.")
             logger.debug(e)
+            if self.cache is not None:
+                # the cached address may be the culprit, don't use it next time
+                self.cache.forget(urlparse(self.url).hostname)
             return None
 
         if response.status_code == 200:
             soup = soup = BeautifulSoup(response.text, 'html.parser')
             match = re.search(r'window.location=\'(.*)\'', soup.find('script').text).group(1)
-            logger.debug(f"window.location redirect has: {match}")
+            logger.debug("window.location redirect has: %s", match)
             return match
         else:
             print('ERROR: Server didn\'t return a proper response, check if it\'s indeed the Fortigate VPN Server.')
             return None
 
+    def prewarm(self) -> bool:
+        """
+        Gets ready for a login after the network changed: drops the pooled connections (which
+        belonged to the previous network) and the cookies of the previous login, resolves the
+        server again, establishes a new connection and fetches the SAML redirect URL, which the
+        next `connect_saml()` returns right away.
+
+        Returns:
+            bool: True if the server answered.
+        """
+        self.session.close()
+        self.session.cookies.clear()
+        self.prewarmed_url = None
+        if self.cache is not None:
+            self.cache.forget(urlparse(self.url).hostname)
+
+        url = self.connect_saml()
+        if not url:
+            return False
+
+        if self.cache is not None:
+            self.cache.write()
+
+        self.prewarmed_url = url
+        self.prewarmed_at = time.monotonic()
+        return True
+
     def get_cookie(self, auth_id: str) -> Optional[str]:
         """
         Requests a cookie from the server by providing an `auth_id` returned by the SAML workflow. This
@@ -71,10 +134,11 @@ class Fortigate(object):
         Returns:
             str|Optional: The `SVPNCOOKIE` returned from the vpn server.
         """
-        response = requests.get(url=f"{self.url}/remote/saml/auth_id?id={auth_id}", timeout=10)
+        response = self.session.get(url=f"{self.url}{self.SAML_AUTH_ID_PATH}?id={auth_id}", timeout=10)
         if response.status_code == 200:
             cookies = response.cookies.get_dict()
-            logger.debug(f"Returned cookies: {cookies}")
+            logs.add_secret(cookies.get('SVPNCOOKIE'))
+            logger.debug("Returned cookies: %s", cookies)
             try:
                 return cookies['SVPNCOOKIE']
             except KeyError:
@@ -90,10 +154,10 @@ class Fortigate(object):
             str: a XML with the vpn configuration
         """
         if self.xml_config is None:
-            response = requests.get(url=f"{self.url}/remote/fortisslvpn_xml", timeout=5)
+            response = self.session.get(url=f"{self.url}{self.XML_CONFIG_PATH}", timeout=5)
             self.xml_config = response.text
 
-        logger.debug(f"VPN XML configuration: {self.xml_config}")
+        logger.debug("VPN XML configuration: %s", self.xml_config)
         return self.xml_config
 
     def get_json_config(self) -> dict:
@@ -107,5 +171,5 @@ class Fortigate(object):
             xml_config = self.get_xml_config()
             self.json_config = xmltodict.parse(xml_config)
 
-        logger.debug(f"VPN JSON configuration: {self.json_config}")
+        logger.debug("VPN JSON configuration: %s", self.json_config)
         return self.json_config
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+    fortigate_vpn_login.loadgen
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Load generator for capacity testing the SAML endpoints of a Fortigate VPN Server.
+"""
+import math
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+import requests
+from requests.adapters import HTTPAdapter
+from fortigate_vpn_login import logger
+from fortigate_vpn_login.fortigate import Fortigate
+
+ENDPOINTS = {
+    'saml_start': Fortigate.SAML_START_PATH,
+    'auth_id': f"{Fortigate.SAML_AUTH_ID_PATH}?id=fortigate-vpn-login-loadgen",
+    'xml_config': Fortigate.XML_CONFIG_PATH,
+}
+
+# the load generator never logs in, so a healthy server rejects its made-up auth id and its config
+# requests without a session cookie: these statuses are answers, not failures
+EXPECTED_REJECTIONS = {
+    'auth_id': {401, 403},
+    'xml_config': {401, 403},
+}
+
+# upper bounds (in milliseconds) of the latency histogram buckets
+HISTOGRAM_BUCKETS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """
+    Nearest-rank percentile.
+
+    Args:
+        values (list): values sorted in ascending order
+        percent (float): the percentile, from 0 to 100
+
+    Returns:
+        float: the percentile value, or 0 if there are no values
+    """
+    if not values:
+        return 0.0
+
+    rank = max(math.ceil(percent * len(values) / 100) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+class LoadReport(object):
+    """
+    Results of a load generator run.
+    """
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = {name: [] for name in ENDPOINTS}
+        self.rejected: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.duration = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, endpoint: str, latency: float, error: Optional[str] = None, rejected: bool = False) -> None:
+        """
+        Records one request.
+
+        Args:
+            endpoint (str): endpoint name, one of `ENDPOINTS`
+            latency (float): request latency in seconds
+            error (str|Optional): error description, if the request failed
+            rejected (bool): True if the server answered with one of `EXPECTED_REJECTIONS`
+        """
+        with self._lock:
+            if error:
+                self.errors[f"{endpoint}: {error}"] += 1
+            else:
+                self.latencies[endpoint].append(latency)
+                if rejected:
+                    self.rejected[endpoint] += 1
+
+    @property
+    def total(self) -> int:
+        return sum(len(latencies) for latencies in self.latencies.values()) + sum(self.errors.values())
+
+    @property
+    def failed(self) -> int:
+        return sum(self.errors.values())
+
+    def __str__(self) -> str:
+        """
+        Returns:
+            str: throughput, latency percentiles and histogram, and the errors found
+        """
+        throughput = self.total / self.duration if self.duration else 0
+        lines = [
+            f"Requests: {self.total} in {self.duration:.2f}s ({throughput:.1f} req/s), "
+            f"{sum(self.rejected.values())} rejected as expected, {self.failed} failed",
+            "",
+            f"{'endpoint':<12} {'answered':>9} {'rejected':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}",
+        ]
+
+        everything = []
+        for name, latencies in self.latencies.items():
+            latencies = sorted(latency * 1000 for latency in latencies)
+            everything += latencies
+            if not latencies:
+                continue
+            lines.append(
+                f"{name:<12} {len(latencies):>9} {self.rejected[name]:>9} {percentile(latencies, 50):>9.1f} "
+                f"{percentile(latencies, 95):>9.1f} {percentile(latencies, 99):>9.1f} {latencies[-1]:>9.1f}"
+            )
+
+        if everything:
+            lines += ["", "Latency histogram:"]
+            bounds = HISTOGRAM_BUCKETS + [None]
+            counts = Counter()
+            for latency in everything:
+                counts[next(bound for bound in bounds if bound is None or latency < bound)] += 1
+            lower = 0
+            for bound in bounds:
+                label = f"{lower}-{bound} ms" if bound else f">= {lower} ms"
+                count = counts[bound]
+                lines.append(f"  {label:<14} {count:>7} {'#' * int(50 * count / len(everything))}")
+                lower = bound
+
+        if self.errors:
+            lines += ["", "Errors:"]
+            lines += [f"  {count:>7} {error}" for error, count in self.errors.most_common()]
+
+        return "\n".join(lines)
+
+
+class LoadGenerator(object):
+    """
+    Drives the SAML endpoints at a given concurrency and rate, using a pool of worker threads. Each
+    worker has its own HTTP session (connection and cookies), like a separate client logging in.
+    """
+    def __init__(self, url: str, requests_count: int = 100, concurrency: int = 10, rate: Optional[float] = None,
+                 endpoints: Optional[List[str]] = None, timeout: float = 10) -> None:
+        """
+        Args:
+            url (str): The URL of the fortigate vpn server.
+            requests_count (int): total number of requests
+            concurrency (int): maximum number of requests in flight
+            rate (float|Optional): requests per second. Unlimited if None.
+            endpoints (list|Optional): endpoint names from `ENDPOINTS`, requested in turns.
+                Defaults to all of them.
+            timeout (float): timeout of each request in seconds
+
+        Raises:
+            ValueError: on invalid arguments
+        """
+        if requests_count < 1:
+            raise ValueError(f"Invalid number of requests: {requests_count}")
+        if concurrency < 1:
+            raise ValueError(f"Invalid concurrency: {concurrency}")
+        if rate is not None and rate <= 0:
+            raise ValueError(f"Invalid rate: {rate}")
+
+        self.url = url
+        self.requests_count = requests_count
+        self.concurrency = concurrency
+        self.rate = rate
+        self.endpoints = endpoints or list(ENDPOINTS)
+        self.timeout = timeout
+        self._local = threading.local()
+
+        for endpoint in self.endpoints:
+            if endpoint not in ENDPOINTS:
+                raise ValueError(f"Invalid endpoint: {endpoint}. Valid endpoints: {', '.join(ENDPOINTS)}")
+
+    @property
+    def session(self) -> requests.Session:
+        """
+        The HTTP session of the current worker thread.
+        """
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+
+        return session
+
+    def _request(self, number: int, endpoint: str, start: float, report: LoadReport) -> None:
+        if self.rate:
+            delay = start + number / self.rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+        request_start = time.monotonic()
+        error = None
+        rejected = False
+        try:
+            response = self.session.get(f"{self.url}{ENDPOINTS[endpoint]}", timeout=self.timeout,
+                                        allow_redirects=False)
+            if response.status_code in EXPECTED_REJECTIONS.get(endpoint, ()):
+                rejected = True
+            elif response.status_code >= 400:
+                error = f"HTTP {response.status_code}"
+        except requests.exceptions.RequestException as e:
+            error = e.__class__.__name__
+
+        report.add(endpoint, time.monotonic() - request_start, error, rejected)
+
+    def run(self) -> LoadReport:
+        """
+        Runs all requests and waits for them to finish.
+
+        Returns:
+            LoadReport: the results
+        """
+        report = LoadReport()
+        logger.debug("Load generator: %s requests to %s, concurrency %s, rate %s, endpoints %s",
+                     self.requests_count, self.url, self.concurrency, self.rate or 'unlimited', self.endpoints)
+
+        start = time.monotonic()
+        futures = {}
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for number in range(self.requests_count):
+                endpoint = self.endpoints[number % len(self.endpoints)]
+                futures[executor.submit(self._request, number, endpoint, start, report)] = endpoint
+
+        report.duration = time.monotonic() - start
+
+        # anything other than a request error still counts, as an error of the request
+        for future, endpoint in futures.items():
+            error = future.exception()
+            if error is not None:
+                logger.debug("Load generator request to %s failed: %r", endpoint, error)
+                report.add(endpoint, 0.0, error.__class__.__name__)
+
+        return report
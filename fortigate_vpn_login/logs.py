@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+    fortigate_vpn_login.logs
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Logging helpers: secret redaction and structured (JSON) records. Both run on the
+    handlers, so nothing is formatted unless a record is actually emitted.
+"""
+import json
+import logging
+import re
+from typing import Set
+
+REDACTED = '<redacted>'
+
+# SVPNCOOKIE values (in cookie strings, dict reprs and command lines) and the SAML auth ids
+# in URLs
+SECRET_PATTERNS = [
+    re.compile(r'''(SVPNCOOKIE['"]?\s*[=:]\s*['"]?)[^'"\s;,&}]+'''),
+    re.compile(r'''(auth_id\?id=)[^&\s'"]+'''),
+]
+
+# attributes of every LogRecord; anything else was passed through `extra=`
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+_secrets: Set[str] = set()
+
+
+def add_secret(value: str) -> None:
+    """
+    Registers a value that must never show up in the logs, like an auth id or a cookie.
+
+    Args:
+        value (str): the secret value
+    """
+    if value and len(value) > 3:
+        _secrets.add(value)
+
+
+def redact(text: str) -> str:
+    """
+    Replaces the registered secrets and anything that looks like a secret.
+
+    Args:
+        text (str): the text to be redacted
+
+    Returns:
+        str: the redacted text
+    """
+    for pattern in SECRET_PATTERNS:
+        text = pattern.sub(rf"\g<1>{REDACTED}", text)
+
+    for secret in _secrets:
+        if secret in text:
+            text = text.replace(secret, REDACTED)
+
+    return text
+
+
+class RedactingFilter(logging.Filter):
+    """
+    Handler filter which formats the message and redacts it. As a handler filter, it only runs
+    for records that are going to be emitted.
+    """
+    def filter(self, record: logging.LogRecord) -> bool:
+        try:
+            message = record.getMessage()
+        except Exception:
+            # arguments not matching the message: keep the record, with the message unformatted
+            message = str(record.msg)
+        record.msg = redact(message)
+        record.args = None
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats each record as one JSON object, including the fields passed through `extra=`. The
+    whole object is redacted, since the extra fields may carry secrets too.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'file': record.filename,
+            'line': record.lineno,
+            'function': record.funcName,
+            'message': record.getMessage(),
+        }
+
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                data[key] = value
+
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+
+        return redact(json.dumps(data, default=str))
+
+
+def setup(json_format: bool = False) -> None:
+    """
+    Installs the redaction on all handlers of the root logger and, optionally, the JSON formatter.
+
+    Args:
+        json_format (bool): if True, records are emitted as JSON
+    """
+    for handler in logging.getLogger().handlers:
+        if not any(isinstance(f, RedactingFilter) for f in handler.filters):
+            handler.addFilter(RedactingFilter())
+        if json_format:
+            handler.setFormatter(JSONFormatter())
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+    fortigate_vpn_login.netwatch
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Listens to Linux network changes (netlink link and address notifications), so the
+    next login can be warmed up as soon as the laptop switches networks or wakes up.
+"""
+import multiprocessing
+import select
+import socket
+import struct
+import time
+from typing import Optional, Tuple
+from fortigate_vpn_login import logger, profiling
+from fortigate_vpn_login import webserver
+from fortigate_vpn_login.fortigate import Fortigate
+
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV6_IFADDR = 0x100
+
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+
+# size of the ifinfomsg and ifaddrmsg headers, the struct format of their interface index, and
+# the attribute with the interface name (IFLA_IFNAME and IFA_LABEL, which IPv6 addresses lack)
+_HEADER_SIZES = {RTM_NEWLINK: 16, RTM_DELLINK: 16, RTM_NEWADDR: 8, RTM_DELADDR: 8}
+_INDEX_FORMATS = {RTM_NEWLINK: '=4xi', RTM_DELLINK: '=4xi', RTM_NEWADDR: '=4xI', RTM_DELADDR: '=4xI'}
+_NAME_ATTRIBUTE = 3
+
+
+def parse_messages(data: bytes) -> list:
+    """
+    Parses netlink route messages.
+
+    Args:
+        data (bytes): data read from the netlink socket
+
+    Returns:
+        list: pairs of (message type, interface name or None)
+    """
+    messages = []
+    offset = 0
+    while offset + 16 <= len(data):
+        length, message_type = struct.unpack('=IH', data[offset:offset + 6])
+        if length < 16:
+            break
+
+        name = None
+        header_size = _HEADER_SIZES.get(message_type)
+        if header_size:
+            position = offset + 16 + header_size
+            while position + 4 <= offset + length:
+                attribute_length, attribute_type = struct.unpack('=HH', data[position:position + 4])
+                if attribute_length < 4:
+                    break
+                if attribute_type == _NAME_ATTRIBUTE:
+                    name = data[position + 4:position + attribute_length].split(b'\0')[0].decode(errors='replace')
+                    break
+                position += (attribute_length + 3) & ~3
+
+            if name is None:
+                index = struct.unpack(_INDEX_FORMATS[message_type], data[offset + 16:offset + 24])[0]
+                try:
+                    name = socket.if_indextoname(index)
+                except OSError:
+                    # the interface is already gone
+                    pass
+
+        messages.append((message_type, name))
+        offset += (length + 3) & ~3
+
+    return messages
+
+
+class NetworkWatcher(object):
+    """
+    Watches link and address (IPv4 and IPv6) changes through a netlink socket.
+    """
+    def __init__(self, debounce: float = 0.5, ignore_interfaces: Tuple[str, ...] = ('tun', 'lo')) -> None:
+        """
+        Args:
+            debounce (float): after a change, seconds to wait for more changes, so a burst of
+                notifications (link up, new address, etc.) counts as only one change
+            ignore_interfaces (tuple): prefixes of interface names to ignore, like the tunnel
+                created by openconnect itself
+        """
+        self.debounce = debounce
+        self.ignore_interfaces = ignore_interfaces
+        self.sock: Optional[socket.socket] = None
+
+    def open(self) -> None:
+        """
+        Subscribes to the netlink notifications.
+        """
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        self.sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR))
+        logger.debug('Watching network changes')
+
+    def close(self) -> None:
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def __enter__(self) -> 'NetworkWatcher':
+        self.open()
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+    def _read(self, timeout: Optional[float]) -> Optional[bool]:
+        """
+        Reads one batch of notifications.
+
+        Returns:
+            bool|Optional: None on timeout, otherwise whether a relevant change was found
+        """
+        readable, _, _ = select.select([self.sock], [], [], timeout)
+        if not readable:
+            return None
+
+        try:
+            data = self.sock.recv(65536)
+        except OSError as e:
+            # ENOBUFS: we missed notifications, which means there were changes
+            logger.debug("Error reading network changes: %s", e)
+            return True
+
+        changed = False
+        for message_type, name in parse_messages(data):
+            if name and name.startswith(self.ignore_interfaces):
+                continue
+            logger.debug("Network change: type %s on %s", message_type, name)
+            changed = True
+
+        return changed
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Blocks until the network changes, or until `timeout` seconds.
+
+        Args:
+            timeout (float|Optional): maximum seconds to wait. Waits forever if None.
+
+        Returns:
+            bool: True if the network changed
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            changed = self._read(remaining)
+            if changed is None:
+                return False
+            if changed:
+                break
+
+        # let the burst of notifications settle
+        while self._read(self.debounce) is not None:
+            pass
+
+        return True
+
+
+class Prewarmer(object):
+    """
+    Warms up the next login: resolves the server, establishes the connection, fetches the
+    SAML redirect URL and starts the callback listener.
+    """
+    def __init__(self, fortigate: Fortigate, profiler: Optional[profiling.Profiler] = None) -> None:
+        """
+        Args:
+            fortigate (Fortigate): the server connection used by the next login
+            profiler (Profiler|Optional): profiler for the callback listener process, if any
+        """
+        self.fortigate = fortigate
+        self.profiler = profiler
+        self.ws: Optional[multiprocessing.Process] = None
+
+    @property
+    def warm(self) -> bool:
+        """
+        True if the next login still starts from the state left by the last `prewarm()`.
+        """
+        return self.fortigate.prewarmed and self.ws is not None and self.ws.is_alive()
+
+    def prewarm(self) -> bool:
+        """
+        Returns:
+            bool: True if the server answered, so the next login starts warm
+        """
+        start = time.monotonic()
+        with profiling.phase('prewarm'):
+            warm = self.fortigate.prewarm()
+            if warm and (self.ws is None or not self.ws.is_alive()):
+                self.ws = webserver.run(self.profiler.for_process('callback') if self.profiler else None)
+
+        logger.debug("Prewarm %s in %.3fs", 'done' if warm else 'failed', time.monotonic() - start)
+        return warm
+
+    def take_webserver(self) -> Optional[multiprocessing.Process]:
+        """
+        Hands over the callback listener started by `prewarm()`, if it's still running.
+
+        Returns:
+            multiprocessing.Process|Optional: the web server process
+        """
+        ws, self.ws = self.ws, None
+        if ws is not None and not ws.is_alive():
+            return None
+        return ws
+
+    def close(self) -> None:
+        """
+        Stops the callback listener, if it wasn't used.
+        """
+        if self.ws is not None:
+            webserver.quit(self.ws)
+            self.ws = None
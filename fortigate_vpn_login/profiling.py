@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""
+    fortigate_vpn_login.profiling
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Profiling helpers for the login workflow: phase boundaries that external
+    profilers can hook into, a cProfile wrapper and tracemalloc snapshots.
+"""
+import cProfile
+import os
+import pstats
+import signal
+import sys
+import tracemalloc
+from contextlib import contextmanager
+from collections import Counter
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from fortigate_vpn_login import logger
+
+PROFILE_FORMATS = ['pstats', 'collapsed']
+
+Hook = Callable[[str, str], None]
+
+_hooks: List[Hook] = []
+
+
+def add_hook(hook: Hook) -> None:
+    """
+    Registers a hook to be called on every phase boundary of the login workflow. The hook receives
+    the phase name (e.g. `connect_saml`) and the event, which is either `start` or `end`.
+
+    Args:
+        hook (Callable): function called as `hook(phase, event)`
+    """
+    if hook not in _hooks:
+        _hooks.append(hook)
+
+
+def remove_hook(hook: Hook) -> None:
+    """
+    Unregisters a hook previously added with `add_hook()`.
+
+    Args:
+        hook (Callable): the hook to be removed
+    """
+    if hook in _hooks:
+        _hooks.remove(hook)
+
+
+def get_malloc_tracer() -> Optional['MallocTracer']:
+    """
+    Gets the `MallocTracer` registered as a hook, if any, so other processes can be traced too.
+
+    Returns:
+        MallocTracer|Optional: the registered tracer
+    """
+    for hook in _hooks:
+        if isinstance(hook, MallocTracer):
+            return hook
+
+    return None
+
+
+def exit_on_sigterm() -> None:
+    """
+    Makes SIGTERM exit through the normal interpreter shutdown, so `finally` blocks still run when the
+    process is terminated (which is how the callback listener is stopped).
+    """
+    def handler(signum: int, frame: object) -> None:
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, handler)
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """
+    Marks a phase of the login workflow, notifying all registered hooks when it starts and ends.
+
+    Args:
+        name (str): the phase name
+    """
+    _notify(name, 'start')
+    try:
+        yield
+    finally:
+        _notify(name, 'end')
+
+
+def _notify(name: str, event: str) -> None:
+    """
+    Calls every registered hook. A failing hook must never break the login, so errors are only logged.
+    """
+    for hook in list(_hooks):
+        try:
+            hook(name, event)
+        except Exception as e:
+            logger.debug("Profiling hook %r failed on %s/%s: %s", hook, name, event, e)
+
+
+class Profiler(object):
+    """
+    Runs cProfile and writes the result as a pstats file or as collapsed stacks (flame graphs).
+    """
+    def __init__(self, filename: str, output_format: str = 'pstats') -> None:
+        """
+        Creates a new profiler. It only starts collecting when `start()` is called, so it can be
+        handed over to a child process before that.
+
+        Args:
+            filename (str): file where the profile will be written
+            output_format (str): either `pstats` or `collapsed`
+        """
+        if output_format not in PROFILE_FORMATS:
+            raise ValueError(f"Invalid profile format: {output_format}")
+
+        self.filename = filename
+        self.output_format = output_format
+        self._profile = None
+
+    def for_process(self, name: str) -> 'Profiler':
+        """
+        Returns a new profiler for another process, writing to `<filename>.<name>`.
+
+        Args:
+            name (str): suffix for the profile filename
+
+        Returns:
+            Profiler: a profiler which was not started yet
+        """
+        return Profiler(f"{self.filename}.{name}", self.output_format)
+
+    def start(self) -> None:
+        """
+        Starts collecting profiling data.
+        """
+        logger.debug("Starting profiler, output: %s (%s)", self.filename, self.output_format)
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def stop(self) -> None:
+        """
+        Stops collecting and writes the profile to `filename`.
+        """
+        if self._profile is None:
+            return
+
+        self._profile.disable()
+        stats = pstats.Stats(self._profile)
+        self._profile = None
+
+        logger.debug("Writing profile to %s", self.filename)
+        if self.output_format == 'collapsed':
+            write_collapsed(stats, self.filename)
+        else:
+            stats.dump_stats(self.filename)
+
+    def stop_on_sigterm(self) -> None:
+        """
+        Makes SIGTERM exit through the normal interpreter shutdown, so the profile still gets written
+        when the process is terminated (which is how the callback listener is stopped).
+        """
+        exit_on_sigterm()
+
+    def __getstate__(self) -> dict:
+        """
+        A running cProfile can't be pickled, so only the settings are passed to child processes.
+        """
+        return {'filename': self.filename, 'output_format': self.output_format, '_profile': None}
+
+
+def _label(func: Tuple[str, int, str]) -> str:
+    filename, line, name = func
+    if filename == '~':
+        return name
+
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def _caller_stacks(entries: Dict, stack: List, time: float) -> Iterator[Tuple[List, float]]:
+    """
+    Splits `time`, spent in the last frame of `stack`, across the callers of its first frame, in
+    proportion to the cumulative time of each caller edge, up to the outermost callers.
+    """
+    callers = {caller: edge for caller, edge in entries.get(stack[-1], (0, 0, 0, 0, {}))[4].items()
+               if caller not in stack}
+    total = sum(edge[3] for edge in callers.values())
+    if total <= 0:
+        yield stack, time
+        return
+
+    for caller, edge in callers.items():
+        share = time * edge[3] / total
+        # anything shorter than a microsecond is rounded away anyway
+        if share >= 0.000001:
+            yield from _caller_stacks(entries, stack + [caller], share)
+
+
+def write_collapsed(stats: pstats.Stats, filename: str) -> None:
+    """
+    Writes profiling stats as collapsed stacks (`frame;frame;frame microseconds`), the format used by
+    `flamegraph.pl` and speedscope. cProfile only records caller/callee pairs: the own time of each
+    function is split across its callers as recorded for each pair, and further up in proportion to
+    the cumulative time of each pair.
+
+    Args:
+        stats (pstats.Stats): profiling stats
+        filename (str): file where the stacks will be written
+    """
+    entries: Dict = stats.stats
+    stacks: Counter = Counter()
+
+    for func, (_, _, own_time, _, callers) in entries.items():
+        edges = {caller: edge[2] for caller, edge in callers.items() if caller != func and edge[2] > 0}
+        total = sum(edges.values())
+        if total <= 0:
+            edges, total = {None: own_time}, own_time
+
+        for caller, edge_time in edges.items():
+            stack = [func] if caller is None else [func, caller]
+            for frames, time in _caller_stacks(entries, stack, own_time * edge_time / total):
+                stacks[";".join(_label(frame) for frame in reversed(frames))] += time
+
+    with open(filename, 'w') as fp:
+        for stack, time in stacks.items():
+            microseconds = int(time * 1000000)
+            if microseconds > 0:
+                fp.write(f"{stack} {microseconds}\n")
+
+
+class MallocTracer(object):
+    """
+    Phase hook that takes a tracemalloc snapshot at the end of each phase and prints the top allocators.
+    """
+    def __init__(self, limit: int = 10, stream: Optional[object] = None) -> None:
+        """
+        Args:
+            limit (int): how many allocators to show on each phase
+            stream (file|Optional): where to print the report. Defaults to `sys.stderr`.
+        """
+        self.limit = limit
+        self.stream = stream or sys.stderr
+
+    def for_process(self) -> 'MallocTracer':
+        """
+        Returns a new tracer for another process, printing to `sys.stderr` (which it inherits).
+
+        Returns:
+            MallocTracer: a tracer which was not started yet
+        """
+        return MallocTracer(self.limit)
+
+    def __getstate__(self) -> dict:
+        """
+        Streams can't be pickled, so child processes print to their own `sys.stderr`.
+        """
+        return {'limit': self.limit}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(**state)
+
+    def start(self) -> None:
+        """
+        Starts tracing memory allocations and registers itself as a phase hook.
+        """
+        tracemalloc.start()
+        add_hook(self)
+
+    def stop(self) -> None:
+        """
+        Stops tracing memory allocations.
+        """
+        remove_hook(self)
+        tracemalloc.stop()
+
+    def __call__(self, name: str, event: str) -> None:
+        if event == 'end':
+            self.report(name)
+
+    def report(self, name: str) -> None:
+        """
+        Takes a snapshot and prints the top allocators, if tracing.
+
+        Args:
+            name (str): what the snapshot is about, like the phase name
+        """
+        if not tracemalloc.is_tracing():
+            return
+
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+
+        print(f"tracemalloc [{name}]: current={current} bytes, peak={peak} bytes", file=self.stream)
+        for stat in snapshot.statistics('lineno')[:self.limit]:
+            print(f"  {stat}", file=self.stream)
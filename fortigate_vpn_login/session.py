@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+"""
+    fortigate_vpn_login.session
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Library API to run many openconnect sessions at the same time, each one with its
+    own pid file, tunnel interface, cookie and log file.
+"""
+import os
+import psutil
+import selectors
+import subprocess
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+from fortigate_vpn_login import utils, logger
+
+
+class SessionError(Exception):
+    """
+    Raised when a session can't be started or is not known by the manager.
+    """
+
+
+class Session(object):
+    """
+    Represents one openconnect process connected to a Fortigate VPN Server.
+    """
+    def __init__(self, name: str, server_url: str, cookie: str, interface: str, state_dir: Path) -> None:
+        """
+        Creates a session. The session only starts when `SessionManager.start()` is called.
+
+        Args:
+            name (str): unique name of the session inside its manager
+            server_url (str): URL of the Fortigate VPN server
+            cookie (str): the `SVPNCOOKIE` for this session
+            interface (str): name of the tunnel interface used by openconnect
+            state_dir (Path): directory for the pid and log files
+        """
+        self.name = name
+        self.server_url = server_url
+        self.cookie = cookie
+        self.interface = interface
+        self.pid_filename = state_dir / f"{name}.pid"
+        self.log_filename = state_dir / f"{name}.log"
+        self.status = utils.VPNStatus.UNKNOWN
+        self.process: Optional[subprocess.Popen] = None
+        # True if openconnect runs through sudo, so `process` is the sudo wrapper
+        self.elevated = False
+        self.pid: Optional[int] = None
+        self.started_at: Optional[float] = None
+        self.ended_at: Optional[float] = None
+
+    @property
+    def returncode(self) -> Optional[int]:
+        """
+        The openconnect exit code, or None while it's running.
+        """
+        return self.process.returncode if self.process else None
+
+    @property
+    def running(self) -> bool:
+        return self.status == utils.VPNStatus.CONNECTED_FOREGROUND
+
+    def __repr__(self) -> str:
+        return (f"{self.__class__.__name__}(name={self.name!r}, interface={self.interface!r}, "
+                f"status={self.status.name})")
+
+
+class SessionManager(object):
+    """
+    Starts, tracks and stops many openconnect sessions. No thread is used per session: the
+    processes are checked with `poll()`, or waited for all at once with `wait()`.
+
+    Example:
+        manager = SessionManager()
+        manager.start('worker-1', 'https://vpn.example.com', cookie)
+        for session in manager.wait():
+            print(session.name, session.returncode)
+        manager.stop_all()
+    """
+    def __init__(self, openconnect_path: Optional[Path] = None, state_dir: Optional[Path] = None,
+                 extra_arguments: Optional[List[str]] = None, interface_prefix: str = 'fvl') -> None:
+        """
+        Args:
+            openconnect_path (Path|Optional): path of the openconnect executable. Defaults to the
+                one found by `utils.find_openconnect()`.
+            state_dir (Path|Optional): where pid and log files of the sessions are written.
+                Defaults to a `sessions` directory alongside the configuration file.
+            extra_arguments (list|Optional): extra openconnect arguments used by all sessions
+            interface_prefix (str): prefix for the tunnel interface names that are not set
+                explicitly. Interfaces are named `<prefix><number>`.
+        """
+        self.openconnect_path = openconnect_path or utils.find_openconnect()
+        if not self.openconnect_path:
+            raise SessionError('openconnect executable not found')
+
+        self.state_dir = Path(state_dir or utils.get_default_config_filepath() / 'sessions')
+        self.extra_arguments = extra_arguments or []
+        self.interface_prefix = interface_prefix
+        self.sessions: Dict[str, Session] = {}
+        self._interface_count = 0
+
+    def _next_interface(self) -> str:
+        in_use = {session.interface for session in self.running()}
+        while True:
+            interface = f"{self.interface_prefix}{self._interface_count}"
+            self._interface_count += 1
+            if interface not in in_use:
+                return interface
+
+    def start(self, name: str, server_url: str, cookie: str, interface: Optional[str] = None) -> Session:
+        """
+        Starts a new openconnect session. The cookie is passed through stdin, so it doesn't
+        show up in the process list, and all openconnect output goes to the session log file.
+        openconnect only writes its pid file when going to the background, so the manager writes
+        it, as soon as the openconnect process is found (it may run through sudo).
+
+        Args:
+            name (str): unique name for the session
+            server_url (str): URL of the Fortigate VPN server
+            cookie (str): the `SVPNCOOKIE` returned by `Fortigate.get_cookie()`
+            interface (str|Optional): tunnel interface name. Defaults to `<prefix><number>`.
+
+        Returns:
+            Session: the started session
+        """
+        if name in self.sessions and self.sessions[name].running:
+            raise SessionError(f"Session already running: {name}")
+
+        os.makedirs(self.state_dir, mode=0o700, exist_ok=True)
+        session = Session(name, server_url, cookie, interface or self._next_interface(), self.state_dir)
+
+        arguments = utils.get_openconnect_arguments(server_url, extra_arguments=[
+            "--cookie-on-stdin",
+            f"--interface={session.interface}",
+        ] + self.extra_arguments)
+        command_line = utils.get_openconnect_command(self.openconnect_path, arguments)
+        session.elevated = command_line[0] == 'sudo'
+
+        env = os.environ.copy()
+        env['LC_ALL'] = 'C'
+
+        logger.debug("Starting session %s on %s, log file: %s", name, session.interface, session.log_filename)
+        with open(session.log_filename, 'ab') as log:
+            session.process = subprocess.Popen(command_line, env=env, stdin=subprocess.PIPE,
+                                               stdout=log, stderr=subprocess.STDOUT)
+
+        try:
+            session.process.stdin.write(f"SVPNCOOKIE={cookie}\n".encode())
+            session.process.stdin.close()
+        except BrokenPipeError:
+            logger.debug("Session %s exited before reading the cookie", name)
+
+        session.status = utils.VPNStatus.CONNECTED_FOREGROUND
+        session.started_at = time.monotonic()
+        self.sessions[name] = session
+        self._find_pid(session)
+        return session
+
+    def _find_pid(self, session: Session) -> Optional[int]:
+        """
+        Finds the pid of the openconnect process of a session, behind sudo if elevated, and
+        writes it to the session pid file.
+
+        Returns:
+            int|Optional: the pid, or None if openconnect wasn't started by sudo yet
+        """
+        if session.pid is not None:
+            return session.pid
+
+        if not session.elevated:
+            session.pid = session.process.pid
+        else:
+            try:
+                children = psutil.Process(session.process.pid).children(recursive=True)
+            except psutil.Error:
+                children = []
+            for child in children:
+                try:
+                    if child.name() == Path(self.openconnect_path).name:
+                        session.pid = child.pid
+                        break
+                except psutil.Error:
+                    continue
+
+        if session.pid is not None:
+            logger.debug("Session %s has openconnect pid %s", session.name, session.pid)
+            try:
+                with open(session.pid_filename, 'w') as fp:
+                    fp.write(str(session.pid))
+            except OSError as e:
+                logger.debug("Could not write pid file %s: %s", session.pid_filename, e)
+
+        return session.pid
+
+    def _kill(self, session: Session) -> None:
+        """
+        Kills openconnect. sudo can't relay SIGKILL, and killing only sudo would leave a root
+        openconnect holding the tunnel interface, so the real openconnect is killed through sudo.
+        """
+        pid = self._find_pid(session)
+        if session.elevated and pid is not None:
+            subprocess.run(['sudo', 'kill', '-KILL', str(pid)], stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL)
+        session.process.kill()
+
+    def get(self, name: str) -> Session:
+        """
+        Gets a session by its name.
+
+        Returns:
+            Session: the session
+        """
+        try:
+            return self.sessions[name]
+        except KeyError:
+            raise SessionError(f"Unknown session: {name}")
+
+    def stop(self, name: str, timeout: float = 10) -> Optional[int]:
+        """
+        Stops a session, asking openconnect to log out (SIGTERM, which sudo relays) and killing
+        it if it doesn't exit after `timeout` seconds.
+
+        Args:
+            name (str): the session name
+            timeout (float): seconds to wait for openconnect to exit
+
+        Returns:
+            int|Optional: the openconnect exit code
+        """
+        session = self.get(name)
+        if session.running:
+            logger.debug("Stopping session %s", name)
+            session.process.terminate()
+            try:
+                session.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                logger.debug("Session %s didn't stop in %ss, killing it", name, timeout)
+                self._kill(session)
+                session.process.wait()
+            self._reap(session)
+
+        return session.returncode
+
+    def stop_all(self, timeout: float = 10) -> None:
+        """
+        Stops all running sessions. All of them are signaled first, so the timeout applies to
+        the whole batch instead of to each session.
+
+        Args:
+            timeout (float): seconds to wait for all openconnect processes to exit
+        """
+        for session in self.running():
+            session.process.terminate()
+
+        deadline = time.monotonic() + timeout
+        while self.running() and time.monotonic() < deadline:
+            self.wait(deadline - time.monotonic())
+
+        for session in self.running():
+            self.stop(session.name, timeout=0)
+
+    def _reap(self, session: Session) -> None:
+        session.status = utils.VPNStatus.DISCONNECTED
+        session.ended_at = time.monotonic()
+        logger.debug("Session %s ended with exit code %s", session.name, session.returncode)
+        try:
+            os.remove(session.pid_filename)
+        except OSError:
+            pass
+
+    def running(self) -> List[Session]:
+        """
+        Returns:
+            list: the sessions which were running on the last check
+        """
+        return [session for session in self.sessions.values() if session.running]
+
+    def poll(self) -> List[Session]:
+        """
+        Checks all running sessions without blocking.
+
+        Returns:
+            list: the sessions that ended since the last check
+        """
+        ended = []
+        for session in self.running():
+            if session.process.poll() is not None:
+                self._reap(session)
+                ended.append(session)
+            else:
+                self._find_pid(session)
+
+        return ended
+
+    def wait(self, timeout: Optional[float] = None) -> List[Session]:
+        """
+        Blocks until at least one running session ends, or until `timeout` seconds. On Linux all
+        processes are watched at once through pidfds, otherwise they are polled.
+
+        Args:
+            timeout (float|Optional): maximum seconds to wait. Waits forever if None.
+
+        Returns:
+            list: the sessions that ended since the last check
+        """
+        ended = self.poll()
+        running = self.running()
+        if ended or not running:
+            return ended
+
+        if hasattr(os, 'pidfd_open'):
+            with selectors.DefaultSelector() as selector:
+                pidfds = []
+                try:
+                    for session in running:
+                        pidfd = os.pidfd_open(session.process.pid)
+                        pidfds.append(pidfd)
+                        selector.register(pidfd, selectors.EVENT_READ, session)
+                    selector.select(timeout)
+                except ProcessLookupError:
+                    # the process ended right before being watched
+                    pass
+                finally:
+                    for pidfd in pidfds:
+                        os.close(pidfd)
+        else:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while all(session.process.poll() is None for session in running):
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+                time.sleep(0.1)
+
+        return self.poll()
+
+    def __iter__(self) -> Iterator[Session]:
+        return iter(list(self.sessions.values()))
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.sessions
@@ -0,0 +1,442 @@
+# -*- coding: utf-8 -*-
+"""
+    fortigate_vpn_login.splitdns
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Local caching DNS forwarder for split DNS: names under the VPN domains are answered
+    by the DNS servers pushed by the Fortigate VPN Server (through the tunnel), everything
+    else by the local resolvers.
+
+    The forwarder is registered with the system resolver by the native vpnc-script (see
+    `fortigate_vpn_login.vpnc_script`), which receives its address through `SPLIT_DNS_ENV`.
+"""
+import ipaddress
+import socket
+import socketserver
+import struct
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from fortigate_vpn_login import logger
+
+Route = Tuple[List[str], List[str]]
+
+DNS_PORT = 53
+MAX_TTL = 3600
+NEGATIVE_TTL = 60
+
+# responses kept in the cache; the expired ones are pruned first when it's full
+MAX_CACHE_ENTRIES = 4096
+
+# environment variables that pass the forwarder (`address:port`) and its domains (separated by
+# spaces) to the vpnc-script
+SPLIT_DNS_ENV = 'FORTIGATE_VPN_LOGIN_SPLIT_DNS'
+SPLIT_DNS_DOMAINS_ENV = 'FORTIGATE_VPN_LOGIN_SPLIT_DNS_DOMAINS'
+
+# not exposed by the socket module on all Python versions
+IP_FREEBIND = getattr(socket, 'IP_FREEBIND', 15)
+
+
+def _as_list(value: object) -> list:
+    """
+    xmltodict returns a dict for a single element and a list for repeated ones.
+    """
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def _split_domains(value: Optional[str]) -> List[str]:
+    if not value:
+        return []
+    return [domain.strip().strip('.').lower() for domain in value.replace(';', ',').split(',') if domain.strip()]
+
+
+def get_vpn_routes(json_config: dict) -> List[Route]:
+    """
+    Reads the DNS servers and domains pushed by the Fortigate VPN Server, from the configuration
+    returned by `Fortigate.get_json_config()`.
+
+    Args:
+        json_config (dict): the vpn configuration
+
+    Returns:
+        list: pairs of (domains, dns servers). Names under those domains should be answered by
+            those servers.
+    """
+    ipv4 = (json_config.get('sslvpn-tunnel') or {}).get('ipv4') or {}
+    routes = []
+
+    for split_dns in _as_list(ipv4.get('split-dns')):
+        servers = [split_dns[key] for key in ('@dnsserver1', '@dnsserver2') if split_dns.get(key)]
+        domains = _split_domains(split_dns.get('@domains'))
+        if servers and domains:
+            routes.append((domains, servers))
+
+    servers = []
+    domains = []
+    for dns in _as_list(ipv4.get('dns')):
+        if dns.get('@ip'):
+            servers.append(dns['@ip'])
+        domains += _split_domains(dns.get('@domain'))
+    if servers and domains:
+        routes.append((domains, servers))
+
+    logger.debug("VPN DNS routes: %s", routes)
+    return routes
+
+
+def get_assigned_address(json_config: dict) -> Optional[str]:
+    """
+    Gets the tunnel address assigned by the Fortigate VPN Server, which openconnect sets on the
+    tunnel device.
+
+    Args:
+        json_config (dict): the vpn configuration
+
+    Returns:
+        str|Optional: the IPv4 address, if the server sent one
+    """
+    ipv4 = (json_config.get('sslvpn-tunnel') or {}).get('ipv4') or {}
+    return (ipv4.get('assigned-addr') or {}).get('@ipv4')
+
+
+def is_privileged_port(port: int, sysctl: str = '/proc/sys/net/ipv4/ip_unprivileged_port_start') -> bool:
+    """
+    Tells whether listening on a port requires root, like the DNS port does.
+
+    Returns:
+        bool: True if only root can listen on the port
+    """
+    start = 1024
+    try:
+        with open(sysctl, 'r') as fp:
+            start = int(fp.read())
+    except (OSError, ValueError) as e:
+        logger.debug("Could not read %s: %s", sysctl, e)
+
+    return 0 < port < start
+
+
+def get_local_nameservers(resolv_conf: str = '/etc/resolv.conf') -> List[str]:
+    """
+    Gets the nameservers currently used by the system. This must be called before the VPN is
+    connected, since the vpnc-script replaces them.
+
+    Returns:
+        list: nameserver addresses
+    """
+    nameservers = []
+    try:
+        with open(resolv_conf, 'r') as fp:
+            for line in fp:
+                fields = line.split()
+                if len(fields) >= 2 and fields[0] == 'nameserver':
+                    nameservers.append(fields[1])
+    except OSError as e:
+        logger.debug("Could not read %s: %s", resolv_conf, e)
+
+    return nameservers
+
+
+def _read_name(data: bytes, offset: int) -> Tuple[str, int]:
+    """
+    Reads a (possibly compressed) domain name from a DNS message.
+
+    Returns:
+        tuple: the name and the offset right after it
+    """
+    labels = []
+    end = None
+    jumps = 0
+    while True:
+        length = data[offset]
+        if length & 0xc0 == 0xc0:
+            if end is None:
+                end = offset + 2
+            jumps += 1
+            if jumps > 16:
+                raise ValueError('DNS name compression loop')
+            offset = struct.unpack('!H', data[offset:offset + 2])[0] & 0x3fff
+            continue
+        offset += 1
+        if length == 0:
+            break
+        labels.append(data[offset:offset + length].decode('ascii', 'replace'))
+        offset += length
+
+    return '.'.join(labels), end if end is not None else offset
+
+
+def parse_question(data: bytes) -> Tuple[str, int, int]:
+    """
+    Parses the first question of a DNS message.
+
+    Returns:
+        tuple: the lowercase name, the query type and the query class
+    """
+    name, offset = _read_name(data, 12)
+    qtype, qclass = struct.unpack('!HH', data[offset:offset + 4])
+    return name.lower(), qtype, qclass
+
+
+def _ttl_offsets(data: bytes) -> List[int]:
+    """
+    Finds the TTL fields of the records in a DNS message.
+
+    Returns:
+        list: offsets of the TTL fields, except the one of the OPT pseudo-record, which uses the
+            field for flags
+    """
+    qdcount, ancount, nscount, arcount = struct.unpack('!HHHH', data[4:12])
+    offset = 12
+    for _ in range(qdcount):
+        _, offset = _read_name(data, offset)
+        offset += 4
+
+    offsets = []
+    for _ in range(ancount + nscount + arcount):
+        _, offset = _read_name(data, offset)
+        rtype, _, _, rdlength = struct.unpack('!HHIH', data[offset:offset + 10])
+        if rtype != 41:
+            offsets.append(offset + 4)
+        offset += 10 + rdlength
+
+    return offsets
+
+
+def get_ttl(data: bytes) -> int:
+    """
+    Gets how long a DNS response can be cached: the lowest TTL of its records, or `NEGATIVE_TTL`
+    for responses without records.
+    """
+    ttls = [struct.unpack('!I', data[offset:offset + 4])[0] for offset in _ttl_offsets(data)]
+    return min(ttls + [MAX_TTL]) if ttls else NEGATIVE_TTL
+
+
+def age_response(data: bytes, elapsed: float) -> bytes:
+    """
+    Lowers the TTL of all records of a cached DNS response by the seconds it spent in the cache.
+
+    Args:
+        data (bytes): the DNS response message
+        elapsed (float): seconds since the response was received
+
+    Returns:
+        bytes: the response with the remaining TTLs
+    """
+    elapsed = int(elapsed)
+    if elapsed <= 0:
+        return data
+
+    response = bytearray(data)
+    for offset in _ttl_offsets(data):
+        ttl = struct.unpack('!I', data[offset:offset + 4])[0]
+        struct.pack_into('!I', response, offset, max(ttl - elapsed, 0))
+
+    return bytes(response)
+
+
+class SplitDNSResolver(object):
+    """
+    Caching DNS forwarder, choosing the upstream servers by the queried domain.
+    """
+    def __init__(self, routes: List[Route], local_servers: List[str], address: str = '127.0.0.1',
+                 port: int = 10053, timeout: float = 2, upstream_port: int = DNS_PORT) -> None:
+        """
+        Args:
+            routes (list): pairs of (domains, servers), as returned by `get_vpn_routes()`
+            local_servers (list): servers for every other name, e.g. from `get_local_nameservers()`
+            address (str): address to listen on. It doesn't need to exist yet, so the tunnel
+                address can be used before openconnect sets it up.
+            port (int): port to listen on, or 0 for any free port
+            timeout (float): seconds to wait for each upstream server
+            upstream_port (int): port of the upstream servers
+        """
+        self.routes = routes
+        # don't forward queries to ourselves
+        self.local_servers = [server for server in local_servers if (server, upstream_port) != (address, port)]
+        self.address = address
+        self.port = port
+        self.timeout = timeout
+        self.upstream_port = upstream_port
+        # question -> (time received, expiration time, response)
+        self.cache: Dict[Tuple[str, int, int], Tuple[float, float, bytes]] = {}
+        self.stats = {
+            'queries': 0,
+            'hits': 0,
+            'errors': 0,
+            'vpn_queries': 0,
+            'vpn_time': 0.0,
+            'local_queries': 0,
+            'local_time': 0.0,
+        }
+        self._lock = threading.Lock()
+        self._server: Optional[socketserver.ThreadingUDPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def get_servers(self, name: str) -> Tuple[str, List[str]]:
+        """
+        Chooses the upstream servers for a name. The longest matching VPN domain wins.
+
+        Returns:
+            tuple: the route name (`vpn` or `local`) and the list of servers
+        """
+        best = None
+        best_length = -1
+        for domains, servers in self.routes:
+            for domain in domains:
+                if (name == domain or name.endswith(f".{domain}")) and len(domain) > best_length:
+                    best = servers
+                    best_length = len(domain)
+
+        if best is not None:
+            return 'vpn', best
+
+        return 'local', self.local_servers
+
+    def _forward(self, query: bytes, servers: List[str]) -> Optional[bytes]:
+        for server in servers:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+                sock.settimeout(self.timeout)
+                try:
+                    sock.sendto(query, (server, self.upstream_port))
+                    while True:
+                        response, _ = sock.recvfrom(65535)
+                        if response[:2] == query[:2]:
+                            return response
+                except OSError as e:
+                    logger.debug("DNS server %s failed: %s", server, e)
+
+        return None
+
+    def resolve(self, query: bytes) -> Optional[bytes]:
+        """
+        Answers a DNS query, from the cache or from the upstream servers.
+
+        Args:
+            query (bytes): the DNS query message
+
+        Returns:
+            bytes|Optional: the DNS response message, or None if no server answered
+        """
+        key = parse_question(query)
+        with self._lock:
+            self.stats['queries'] += 1
+            cached = self.cache.get(key)
+            now = time.monotonic()
+            if cached and cached[1] > now:
+                self.stats['hits'] += 1
+                # answer with the transaction id of this query
+                return query[:2] + age_response(cached[2], now - cached[0])[2:]
+
+        route, servers = self.get_servers(key[0])
+        start = time.monotonic()
+        response = self._forward(query, servers)
+        elapsed = time.monotonic() - start
+
+        with self._lock:
+            self.stats[f"{route}_queries"] += 1
+            self.stats[f"{route}_time"] += elapsed
+            if response is None:
+                self.stats['errors'] += 1
+                return None
+
+            # only cache successful and NXDOMAIN responses
+            if response[3] & 0x0f in (0, 3):
+                self._store(key, response)
+
+        return response
+
+    def _store(self, key: Tuple[str, int, int], response: bytes) -> None:
+        """
+        Caches a response, making room for it if the cache is full. Must be called with the lock held.
+        """
+        now = time.monotonic()
+        self.cache.pop(key, None)
+        if len(self.cache) >= MAX_CACHE_ENTRIES:
+            for expired in [name for name, (_, expires, _) in self.cache.items() if expires <= now]:
+                del self.cache[expired]
+        while len(self.cache) >= MAX_CACHE_ENTRIES:
+            # the oldest entry
+            del self.cache[next(iter(self.cache))]
+
+        self.cache[key] = (now, now + get_ttl(response), response)
+
+    def is_local_client(self, address: str) -> bool:
+        """
+        Only this host is answered, even when listening on the tunnel address.
+        """
+        return address == self.address or ipaddress.ip_address(address).is_loopback
+
+    def get_script_environment(self) -> Dict[str, str]:
+        """
+        Returns:
+            dict: the environment variables which make the native vpnc-script register this
+                forwarder with the system resolver, for the VPN domains
+        """
+        domains = sorted({domain for domains, _ in self.routes for domain in domains})
+        return {SPLIT_DNS_ENV: f"{self.address}:{self.port}", SPLIT_DNS_DOMAINS_ENV: " ".join(domains)}
+
+    def start(self) -> None:
+        """
+        Starts listening for queries in a background thread.
+        """
+        resolver = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self) -> None:
+                query, sock = self.request
+                if not resolver.is_local_client(self.client_address[0]):
+                    logger.debug("Ignoring DNS query from %s", self.client_address)
+                    return
+                try:
+                    response = resolver.resolve(query)
+                except (ValueError, IndexError, struct.error) as e:
+                    logger.debug("Invalid DNS query from %s: %s", self.client_address, e)
+                    return
+                if response:
+                    sock.sendto(response, self.client_address)
+
+        class Server(socketserver.ThreadingUDPServer):
+            daemon_threads = True
+
+            def server_bind(self) -> None:
+                self.socket.setsockopt(socket.IPPROTO_IP, IP_FREEBIND, 1)
+                super().server_bind()
+
+        self._server = Server((self.address, self.port), Handler)
+        # when listening on port 0, the port chosen by the system
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        logger.debug("Split DNS resolver listening on %s:%s", self.address, self.port)
+
+    def stop(self) -> None:
+        """
+        Stops listening for queries.
+        """
+        if self._server is None:
+            return
+
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+
+    def report(self) -> str:
+        """
+        Returns:
+            str: a summary of the cache hit rate and the upstream latency per route
+        """
+        stats = self.stats
+        hit_rate = 100 * stats['hits'] / stats['queries'] if stats['queries'] else 0
+        lines = [f"Split DNS: {stats['queries']} queries, {hit_rate:.1f}% cache hits, {stats['errors']} errors"]
+        for route in ('vpn', 'local'):
+            queries = stats[f"{route}_queries"]
+            average = 1000 * stats[f"{route}_time"] / queries if queries else 0
+            lines.append(f"  {route}: {queries} upstream queries, {average:.1f} ms average")
+        lines.append(f"  cache: {len(self.cache)} entries")
+
+        return "\n".join(lines)
@@ -9,11 +9,11 @@ import os
 import psutil
 import subprocess
 import re
-from typing import Optional
+from typing import List, Optional
 from shutil import which
 from pathlib import Path
 from enum import Enum, auto
-from fortigate_vpn_login import logger
+from fortigate_vpn_login import __version__, logger
 
 
 class VPNStatus(Enum):
@@ -76,7 +76,7 @@ def find_openconnect() -> Optional[Path]:
     if not openconnect_path:
         return None
     else:
-        logger.debug(f"Found openconnect path: {openconnect_path}")
+        logger.debug("Found openconnect path: %s", openconnect_path)
         return Path(openconnect_path)
 
 
@@ -88,7 +88,7 @@ def is_openconnect_running_windows():
         bool: True if running on Windows. False if not.
     """
     running = 'openconnect.exe' in (p.name() for p in psutil.process_iter(["name"]))
-    logger.debug(f"is openconnect running on windows? {running}")
+    logger.debug("is openconnect running on windows? %s", running)
     if running:
         return True
     else:
@@ -109,7 +109,7 @@ def get_openconnect_pid(pid_file: str) -> int:
     with open(pid_file, 'r') as fp:
         pid = int(fp.read())
 
-    logger.debug(f"get openconnect pid: {pid}")
+    logger.debug("get openconnect pid: %s", pid)
     if pid and not psutil.pid_exists(pid):
         pid = None
 
@@ -131,7 +131,7 @@ def check_openconnect_version(openconnect_path: Path) -> bool:
     env['LC_ALL'] = 'C'
     process = subprocess.run([openconnect_path, '--version'], env=env, capture_output=True)
     output = process.stdout.decode("utf-8")
-    logger.debug(f"Checking openconnect version: {output}")
+    logger.debug("Checking openconnect version: %s", output)
 
     if not process.returncode == 0:
         return False
@@ -145,9 +145,67 @@ def check_openconnect_version(openconnect_path: Path) -> bool:
     openconnect_supported_protocols = match.group(1)
     openconnect_supported_protocols = openconnect_supported_protocols.replace("(default)", "")
     openconnect_supported_protocols = [x.strip() for x in openconnect_supported_protocols.split(',')]
-    logger.debug(f"Openconnect supported protocols: {openconnect_supported_protocols}")
+    logger.debug("Openconnect supported protocols: %s", openconnect_supported_protocols)
 
     if 'fortinet' not in openconnect_supported_protocols:
         return False
 
     return True
+
+
+def get_openconnect_arguments(server_url: str, cookie: Optional[str] = None,
+                              extra_arguments: Optional[List[str]] = None) -> List[str]:
+    """
+    Builds the arguments used to connect openconnect to a Fortigate VPN Server.
+
+    Args:
+        server_url (str): URL of the Fortigate VPN server
+        cookie (str|Optional): the `SVPNCOOKIE` value. If not set, openconnect should receive it
+            in some other way, like with `--cookie-on-stdin`.
+        extra_arguments (list|Optional): arguments appended to the defaults
+
+    Returns:
+        list: the openconnect arguments
+    """
+    arguments = [
+        "--protocol=fortinet",
+        f"--server={server_url}",
+        f"--useragent=fortigate-vpn-login-{__version__}:{os.uname().version}",
+        "--no-dtls",
+        "--non-inter",
+        "--disable-ipv6",
+    ]
+
+    if cookie:
+        arguments.append(f"--cookie=SVPNCOOKIE={cookie}")
+
+    return arguments + (extra_arguments or [])
+
+
+def get_openconnect_command(openconnect_path: Path, arguments: List[str]) -> List[str]:
+    """
+    Builds the command line that runs openconnect with elevated privileges: through `sudo` on UNIX
+    (unless we're already root) and through an elevated `Start-Process` on Windows.
+
+    Args:
+        openconnect_path (Path): path of the openconnect executable
+        arguments (list): openconnect arguments
+
+    Returns:
+        list: the command line to be executed
+    """
+    if is_windows():
+        workdir = openconnect_path.parent
+        return [
+            "powershell",
+            "-Command",
+            f"Start-Process '{str(openconnect_path)}' "
+            f"-ArgumentList {','.join(arguments)} "
+            f"-Verb runAs -WorkingDirectory {workdir}",
+        ]
+
+    command_line = []
+    if not os.getuid() == 0:
+        command_line.append("sudo")
+
+    return command_line + [str(openconnect_path)] + arguments
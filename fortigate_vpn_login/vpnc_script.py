@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""
+    fortigate_vpn_login.vpnc_script
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Replacement for openconnect's vpnc-script on Linux. All routes are installed with a
+    single `ip -batch` execution, and only the routes that changed since the last run are
+    added or removed, so reconnecting with thousands of split routes is fast.
+
+    openconnect calls it through `--script`, with the tunnel settings in environment
+    variables. See <https://www.infradead.org/openconnect/vpnc-script.html>.
+"""
+import ipaddress
+import json
+import os
+import shlex
+import subprocess
+import sys
+from pathlib import Path
+from shutil import which
+from typing import Dict, List, Mapping, Optional, Set, Tuple
+from fortigate_vpn_login import logger
+from fortigate_vpn_login.splitdns import DNS_PORT, SPLIT_DNS_ENV, SPLIT_DNS_DOMAINS_ENV
+
+STATE_DIR = Path('/run/fortigate-vpn-login')
+RESOLV_CONF = Path('/etc/resolv.conf')
+
+# routes used when the server doesn't push split routes: the whole internet, without
+# replacing the default route
+FULL_TUNNEL_ROUTES = {'0.0.0.0/1', '128.0.0.0/1'}
+
+
+def get_script_command(env: Optional[Mapping[str, str]] = None) -> str:
+    """
+    Gets the command line to be used on openconnect's `--script` option. openconnect runs it as
+    root, whose Python may not see where this package is installed (like with `pip install
+    --user`), so the directory of the package is passed on `PYTHONPATH`.
+
+    Args:
+        env (dict|Optional): extra environment variables for the script, like the ones from
+            `SplitDNSResolver.get_script_environment()`
+
+    Returns:
+        str: the command line, which openconnect runs through `/bin/sh -c`
+    """
+    env = dict(env or {})
+    env['PYTHONPATH'] = str(Path(__file__).resolve().parent.parent)
+
+    # only the values are quoted, or the shell wouldn't take them as variable assignments
+    command = [f"{key}={shlex.quote(value)}" for key, value in env.items()]
+    command += [shlex.quote(part) for part in (sys.executable, '-m', 'fortigate_vpn_login.vpnc_script')]
+    return " ".join(command)
+
+
+def get_split_routes(env: Mapping[str, str], kind: str) -> Set[str]:
+    """
+    Reads the split routes pushed by the server.
+
+    Args:
+        env (dict): the environment set by openconnect
+        kind (str): `INC` for routes through the tunnel, `EXC` for routes outside of it
+
+    Returns:
+        set: the routes, as normalized `address/length` networks
+    """
+    routes = set()
+    for number in range(int(env.get(f"CISCO_SPLIT_{kind}", 0))):
+        prefix = f"CISCO_SPLIT_{kind}_{number}"
+        address = env.get(f"{prefix}_ADDR")
+        length = env.get(f"{prefix}_MASKLEN") or env.get(f"{prefix}_MASK")
+        if not address or not length:
+            continue
+        try:
+            routes.add(str(ipaddress.IPv4Network(f"{address}/{length}", strict=False)))
+        except ValueError as e:
+            logger.debug("Ignoring invalid split route %s/%s: %s", address, length, e)
+
+    return routes
+
+
+def _normalize_route(destination: str) -> str:
+    if destination == 'default':
+        return '0.0.0.0/0'
+    return str(ipaddress.IPv4Network(destination, strict=False))
+
+
+def get_tunnel_routes(device: str) -> Set[str]:
+    """
+    Gets the routes we installed on the tunnel device. They're the ones with `proto static`, so
+    the routes the kernel adds by itself are left alone.
+
+    Args:
+        device (str): the tunnel device
+
+    Returns:
+        set: the routes, as normalized `address/length` networks
+    """
+    process = subprocess.run(['ip', '-4', '-o', 'route', 'show', 'dev', device, 'proto', 'static'],
+                             capture_output=True, text=True)
+    return {_normalize_route(line.split()[0]) for line in process.stdout.splitlines() if line.strip()}
+
+
+def get_gateway_route(address: str) -> Optional[str]:
+    """
+    Gets how `address` is reached right now, to keep reaching the VPN server (and the excluded
+    networks) outside of the tunnel.
+
+    Returns:
+        str|Optional: the route spec, like `via 192.168.0.1 dev wlan0`
+    """
+    process = subprocess.run(['ip', '-4', '-o', 'route', 'get', address], capture_output=True, text=True)
+    fields = process.stdout.split()
+    spec = []
+    for key in ('via', 'dev'):
+        if key in fields and fields.index(key) + 1 < len(fields):
+            spec += [key, fields[fields.index(key) + 1]]
+
+    return " ".join(spec) if 'dev' in spec else None
+
+
+def get_batch(device: str, wanted: Set[str], installed: Set[str]) -> List[str]:
+    """
+    Builds the `ip -batch` commands that turn the installed tunnel routes into the wanted ones.
+
+    Args:
+        device (str): the tunnel device
+        wanted (set): routes the tunnel should have
+        installed (set): routes the tunnel has
+
+    Returns:
+        list: `ip` commands, without the leading `ip`
+    """
+    commands = [f"route del {route} dev {device} proto static" for route in sorted(installed - wanted)]
+    commands += [f"route replace {route} dev {device} proto static" for route in sorted(wanted - installed)]
+    return commands
+
+
+def run_batch(commands: List[str]) -> bool:
+    """
+    Runs `ip` commands in a single `ip -batch` execution. Errors on one command don't stop the others.
+
+    Returns:
+        bool: True if all commands succeeded
+    """
+    if not commands:
+        return True
+
+    logger.debug("Running %s ip commands", len(commands))
+    process = subprocess.run(['ip', '-force', '-batch', '-'], input="\n".join(commands) + "\n",
+                             capture_output=True, text=True)
+    if process.returncode != 0:
+        print(f"ERROR: ip -batch failed: {process.stderr.strip()}", file=sys.stderr)
+        return False
+
+    return True
+
+
+def _state_filename(device: str) -> Path:
+    return STATE_DIR / f"{device}.json"
+
+
+def load_state(device: str) -> Dict:
+    try:
+        with open(_state_filename(device), 'r') as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_state(device: str, state: Dict) -> None:
+    try:
+        os.makedirs(STATE_DIR, mode=0o700, exist_ok=True)
+        with open(_state_filename(device), 'w') as fp:
+            json.dump(state, fp)
+    except OSError as e:
+        print(f"ERROR: Could not write route state: {e}", file=sys.stderr)
+
+
+def get_outside_routes(env: Mapping[str, str], full_tunnel: bool) -> Tuple[Dict[str, str], Optional[str]]:
+    """
+    Gets the routes that must keep going outside the tunnel: the VPN server itself (only needed
+    when all traffic goes through the tunnel) and the excluded split routes.
+
+    Returns:
+        tuple: a dict of network to route spec, and the spec of the original route to the VPN server
+    """
+    gateway = env.get('VPNGATEWAY')
+    spec = get_gateway_route(gateway) if gateway else None
+    routes = {}
+    if spec:
+        if full_tunnel:
+            routes[f"{gateway}/32"] = spec
+        for route in get_split_routes(env, 'EXC'):
+            routes[route] = spec
+
+    return routes, spec
+
+
+def write_resolv_conf(servers: List[str], domains: Optional[List[str]] = None) -> Optional[str]:
+    """
+    Points `/etc/resolv.conf` to other servers, keeping its options. Used when there's no
+    systemd-resolved.
+
+    Args:
+        servers (list): nameserver addresses
+        domains (list|Optional): search domains
+
+    Returns:
+        str|Optional: the previous content, to be restored on disconnect, or None on errors
+    """
+    try:
+        previous = RESOLV_CONF.read_text()
+    except OSError:
+        previous = ''
+
+    lines = ['# generated by fortigate-vpn-login, restored on disconnect']
+    lines += [f"nameserver {server}" for server in servers]
+    if domains:
+        lines.append(f"search {' '.join(domains)}")
+    lines += [line for line in previous.splitlines() if line.startswith('options')]
+    try:
+        RESOLV_CONF.write_text("\n".join(lines) + "\n")
+    except OSError as e:
+        print(f"ERROR: Could not write {RESOLV_CONF}: {e}", file=sys.stderr)
+        return None
+
+    return previous
+
+
+def restore_resolv_conf(previous: str) -> None:
+    try:
+        RESOLV_CONF.write_text(previous)
+    except OSError as e:
+        print(f"ERROR: Could not restore {RESOLV_CONF}: {e}", file=sys.stderr)
+
+
+def configure_split_dns(env: Mapping[str, str], device: str) -> Optional[str]:
+    """
+    Registers the split DNS forwarder run by the CLI (`--split-dns`) with the system resolver. With
+    systemd-resolved, it's the DNS server of the tunnel device for the VPN domains only, so every
+    other name keeps going to the local resolvers. Otherwise it replaces the nameservers in
+    `/etc/resolv.conf`, which only works on port 53.
+
+    Returns:
+        str|Optional: the previous `/etc/resolv.conf` content, if it was replaced
+    """
+    forwarder = env[SPLIT_DNS_ENV]
+    address, _, port = forwarder.rpartition(':')
+    domains = env.get(SPLIT_DNS_DOMAINS_ENV, '').split()
+
+    if which('resolvectl'):
+        subprocess.run(['resolvectl', 'dns', device, forwarder])
+        subprocess.run(['resolvectl', 'domain', device] + [f"~{domain}" for domain in domains])
+        subprocess.run(['resolvectl', 'default-route', device, 'false'])
+        return None
+
+    if int(port) == DNS_PORT:
+        return write_resolv_conf([address])
+
+    print(f"WARNING: systemd-resolved not found and /etc/resolv.conf can't use port {port}: the split DNS "
+          f"forwarder at {forwarder} is not used by the system. To use it, set split_dns_port = 53 and run "
+          "fortigate-vpn-login as root (only openconnect is run through sudo).",
+          file=sys.stderr)
+    return None
+
+
+def configure_dns(env: Mapping[str, str], device: str) -> Optional[str]:
+    """
+    Sets the VPN DNS servers and domains on the tunnel device, through systemd-resolved. Without
+    it, they replace the ones in `/etc/resolv.conf`, like the vpnc-script from openconnect does.
+    With `--split-dns`, the forwarder is registered instead.
+
+    Returns:
+        str|Optional: the previous `/etc/resolv.conf` content, if it was replaced
+    """
+    if env.get(SPLIT_DNS_ENV):
+        return configure_split_dns(env, device)
+
+    servers = env.get('INTERNAL_IP4_DNS', '').split()
+    if not servers:
+        return None
+
+    if not which('resolvectl'):
+        logger.debug('resolvectl not found, writing the VPN DNS servers to %s', RESOLV_CONF)
+        return write_resolv_conf(servers, env.get('CISCO_DEF_DOMAIN', '').split())
+
+    domains = env.get('CISCO_SPLIT_DNS', '').replace(',', ' ').split() or env.get('CISCO_DEF_DOMAIN', '').split()
+    subprocess.run(['resolvectl', 'dns', device] + servers)
+    if domains:
+        subprocess.run(['resolvectl', 'domain', device] + [f"~{domain}" for domain in domains])
+
+    return None
+
+
+def connect(env: Mapping[str, str]) -> int:
+    """
+    Configures the tunnel device, its address and routes. Also used on reconnects, when only the
+    routes that changed are touched.
+
+    Returns:
+        int: exit code for openconnect
+    """
+    device = env['TUNDEV']
+    state = load_state(device)
+
+    commands = [f"link set dev {device} up"]
+    if env.get('INTERNAL_IP4_MTU'):
+        commands[0] += f" mtu {env['INTERNAL_IP4_MTU']}"
+    if env.get('INTERNAL_IP4_ADDRESS'):
+        commands.append(f"addr replace {env['INTERNAL_IP4_ADDRESS']}/32 dev {device}")
+
+    wanted = get_split_routes(env, 'INC')
+    full_tunnel = not wanted
+    if full_tunnel:
+        wanted = set(FULL_TUNNEL_ROUTES)
+
+    # keep the previous outside routes when reconnecting: the route to the VPN server may
+    # already go through the tunnel at this point
+    outside, spec = get_outside_routes(env, full_tunnel)
+    if not spec and state.get('outside'):
+        outside = state['outside']
+
+    previous_outside = state.get('outside', {})
+    commands += [f"route del {route}" for route in sorted(set(previous_outside) - set(outside))]
+    commands += [f"route replace {route} {route_spec} proto static"
+                 for route, route_spec in sorted(outside.items()) if previous_outside.get(route) != route_spec]
+    commands += get_batch(device, wanted, get_tunnel_routes(device))
+
+    logger.debug("%s: %s tunnel routes, %s outside routes", device, len(wanted), len(outside))
+    success = run_batch(commands)
+
+    resolv_conf = configure_dns(env, device)
+
+    new_state = {'outside': outside}
+    # on reconnects, keep the original resolv.conf instead of the one we wrote
+    if 'resolv_conf' in state:
+        new_state['resolv_conf'] = state['resolv_conf']
+    elif resolv_conf is not None:
+        new_state['resolv_conf'] = resolv_conf
+    write_state(device, new_state)
+
+    return 0 if success else 1
+
+
+def disconnect(env: Mapping[str, str]) -> int:
+    """
+    Removes the routes outside of the tunnel and restores `/etc/resolv.conf`. The tunnel routes (and
+    the systemd-resolved settings) go away with the tunnel device.
+
+    Returns:
+        int: exit code for openconnect
+    """
+    device = env['TUNDEV']
+    state = load_state(device)
+    run_batch([f"route del {route}" for route in sorted(state.get('outside', {}))])
+    if 'resolv_conf' in state:
+        restore_resolv_conf(state['resolv_conf'])
+
+    try:
+        os.remove(_state_filename(device))
+    except OSError:
+        pass
+
+    return 0
+
+
+def main(env: Optional[Mapping[str, str]] = None) -> int:
+    """
+    Entry point called by openconnect.
+
+    Returns:
+        int: exit code for openconnect
+    """
+    env = env if env is not None else os.environ
+    reason = env.get('reason')
+    logger.debug("vpnc-script reason: %s", reason)
+
+    if reason in ('connect', 'reconnect'):
+        return connect(env)
+
+    if reason == 'disconnect':
+        return disconnect(env)
+
+    # pre-init and attempt-reconnect have nothing to do here: the route to the VPN server
+    # is kept until disconnect
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,15 +10,18 @@
 """
 import multiprocessing
 import logging
+from typing import Optional
 from werkzeug import Request, Response, run_simple
-from fortigate_vpn_login import logger
+from fortigate_vpn_login import logger, logs
+from fortigate_vpn_login.profiling import MallocTracer, Profiler, exit_on_sigterm, get_malloc_tracer
 
 logging.getLogger('werkzeug').setLevel(logging.ERROR)
 
 queue = multiprocessing.Queue()
 
 
-def get_token(q: multiprocessing.Queue, host: str = "127.0.0.1", port: int = 8020) -> None:
+def get_token(q: multiprocessing.Queue, host: str = "127.0.0.1", port: int = 8020,
+              profiler: Optional[Profiler] = None, malloc_tracer: Optional[MallocTracer] = None) -> None:
     """
     Opens a web server on `localhost:8020`, listens to a request searching for the `id`
     parameter. The value is then put inside the global queue.
@@ -27,26 +30,54 @@ def get_token(q: multiprocessing.Queue, host: str = "127.0.0.1", port: int = 802
         q (multiprocessing.Queue): queue object to put the value of the request parameter
         host (str|Optional): hostname or ip address to bind to the webserver
         port (int|Optional): port number to bind to the webserver
+        profiler (Profiler|Optional): if set, profiles this process until it's terminated
+        malloc_tracer (MallocTracer|Optional): if set, traces the allocations of this process and prints
+            the top allocators when it's terminated
     """
     @Request.application
     def app(request: Request) -> Response:
-        logger.debug(f"Putting value in the queue: {request.args['id']}")
+        logs.add_secret(request.args['id'])
+        logger.debug("Putting value in the queue: %s", request.args['id'])
         q.put(request.args['id'])
         return Response('', 204)
 
-    logger.debug(f"Running web server on {host}:{port}")
-    run_simple(host, port, app)
-
-
-def run() -> multiprocessing.Process:
+    logger.debug("Running web server on %s:%s", host, port)
+    if profiler is None and malloc_tracer is None:
+        run_simple(host, port, app)
+        return
+
+    exit_on_sigterm()
+    if profiler:
+        profiler.start()
+    if malloc_tracer:
+        malloc_tracer.start()
+    try:
+        run_simple(host, port, app)
+    finally:
+        if malloc_tracer:
+            malloc_tracer.report('callback listener')
+            malloc_tracer.stop()
+        if profiler:
+            profiler.stop()
+
+
+def run(profiler: Optional[Profiler] = None) -> multiprocessing.Process:
     """
-    Runs the web server (`get_token` method) in a separate process.
+    Runs the web server (`get_token` method) in a separate process. If a `MallocTracer` is registered
+    as a phase hook, the allocations of that process are traced too.
+
+    Args:
+        profiler (Profiler|Optional): if set, the web server process is profiled with it
 
     Returns:
         multiprocessing.Process: the Process object running the method
     """
     global queue
-    p = multiprocessing.Process(target=get_token, args=(queue,))
+    malloc_tracer = get_malloc_tracer()
+    p = multiprocessing.Process(target=get_token, args=(queue,), kwargs={
+        'profiler': profiler,
+        'malloc_tracer': malloc_tracer.for_process() if malloc_tracer else None,
+    })
     logger.debug('Starting another process to run the webserver')
     p.start()
     return p
@@ -59,7 +90,8 @@ def return_token() -> str:
     global queue
     print("Waiting for the token...")
     token = queue.get(block=True)
-    logger.debug(f"Got token: {token}")
+    logs.add_secret(token)
+    logger.debug("Got token: %s", token)
     return (token)
 
 
@@ -72,3 +104,4 @@ def quit(p: multiprocessing.Process) -> None:
     """
     logger.debug('Terminating the web server process')
     p.terminate()
+    p.join(5)
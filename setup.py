@@ -49,12 +49,14 @@ setup(
     extras_require={
         'dev': [
             'build==0.10.0',
-            'twine-4.0.2'
+            'twine-4.0.2',
+            'pytest'
         ]
     },
     entry_points={
         'console_scripts': [
-            'fortigate-vpn-login=fortigate_vpn_login.cli:main'
+            'fortigate-vpn-login=fortigate_vpn_login.cli:main',
+            'fortigate-vpn-login-vpnc-script=fortigate_vpn_login.vpnc_script:main'
         ]
     }
 )
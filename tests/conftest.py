@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.conftest
+    ~~~~~~~~~~~~~~
+
+    Shared fixtures: a local stand-in for the Fortigate VPN Server and a fake openconnect binary.
+"""
+import os
+import stat
+import sys
+from pathlib import Path
+import pytest
+from tests.gateway import StandInGateway
+
+# fakes openconnect: reads the cookie, checks it against the gateway like the real one does when
+# fetching the tunnel config and stays "connected" until SIGTERM (or SIGKILL, with
+# FAKE_OPENCONNECT_IGNORE_TERM). Like the real one, it only writes the pid file in background.
+FAKE_OPENCONNECT = """#!{python}
+import os, signal, sys, time, urllib.error, urllib.request
+
+arguments = dict(argument[2:].split('=', 1) for argument in sys.argv[1:] if '=' in argument)
+if '--version' in sys.argv:
+    print('OpenConnect version v9.12')
+    print('Supported protocols: anyconnect (default), nc, gp, pulse, f5, fortinet, array')
+    sys.exit(0)
+
+cookie = arguments.get('cookie') or sys.stdin.readline().strip()
+request = urllib.request.Request(arguments['server'] + '/remote/fortisslvpn_xml', headers={{'Cookie': cookie}})
+try:
+    urllib.request.urlopen(request, timeout=5).read()
+except urllib.error.URLError as e:
+    print('Cookie was rejected by server:', e)
+    sys.exit(2)
+
+if os.environ.get('FAKE_OPENCONNECT_IGNORE_TERM'):
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+else:
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+if 'pid-file' in arguments and '--background' in sys.argv:
+    with open(arguments['pid-file'], 'w') as fp:
+        fp.write(str(os.getpid()))
+print('Connected as 10.212.134.200, using SSL')
+sys.stdout.flush()
+time.sleep(float(os.environ.get('FAKE_OPENCONNECT_LIFETIME', '3600')))
+"""
+
+# fakes sudo: runs the command as a child and relays SIGTERM to it, but (like the real one)
+# can't relay SIGKILL
+FAKE_SUDO = """#!{python}
+import signal, subprocess, sys
+
+process = subprocess.Popen(sys.argv[1:])
+signal.signal(signal.SIGTERM, lambda *args: process.terminate())
+sys.exit(process.wait())
+"""
+
+
+def write_executable(path: Path, content: str) -> Path:
+    os.makedirs(path.parent, exist_ok=True)
+    path.write_text(content.format(python=sys.executable))
+    path.chmod(path.stat().st_mode | stat.S_IXUSR)
+    return path
+
+
+@pytest.fixture
+def gateway():
+    server = StandInGateway()
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def fake_openconnect(tmp_path: Path, monkeypatch) -> Path:
+    path = write_executable(tmp_path / 'bin' / 'openconnect', FAKE_OPENCONNECT)
+
+    # run it directly instead of through sudo
+    monkeypatch.setattr(os, 'getuid', lambda: 0)
+    return path
+
+
+@pytest.fixture
+def fake_sudo(tmp_path: Path, monkeypatch) -> Path:
+    path = write_executable(tmp_path / 'sudo-bin' / 'sudo', FAKE_SUDO)
+    monkeypatch.setenv('PATH', f"{path.parent}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setattr(os, 'getuid', lambda: 1000)
+    return path
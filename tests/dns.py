@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.dns
+    ~~~~~~~~~
+
+    Stand-in DNS server and a DNS query builder, used by the tests and the benchmarks.
+"""
+import socket
+import socketserver
+import struct
+import threading
+import time
+from collections import Counter
+from fortigate_vpn_login.splitdns import parse_question
+
+
+def build_query(name: str, qtype: int = 1, query_id: int = 0x1234) -> bytes:
+    """
+    Builds a DNS query with one question (class IN).
+    """
+    labels = b''.join(bytes([len(label)]) + label.encode() for label in name.split('.'))
+    return struct.pack('!HHHHHH', query_id, 0x0100, 1, 0, 0, 0) + labels + b'\0' + struct.pack('!HH', qtype, 1)
+
+
+def build_response(query: bytes, address: str, ttl: int) -> bytes:
+    """
+    Builds the response to a query, with one A record. Names starting with `missing` get NXDOMAIN.
+    """
+    name, qtype, _ = parse_question(query)
+    question_end = query.index(b'\0', 12) + 5
+    if name.startswith('missing'):
+        return query[:2] + struct.pack('!HHHHH', 0x8183, 1, 0, 0, 0) + query[12:question_end]
+
+    answer = struct.pack('!HHHIH', 0xc00c, 1, 1, ttl, 4) + socket.inet_aton(address)
+    return query[:2] + struct.pack('!HHHHH', 0x8180, 1, 1, 0, 0) + query[12:question_end] + answer
+
+
+class StandInDNSServer(object):
+    """
+    Answers every name with the same address, after a delay (like the round trip through the tunnel).
+    """
+    def __init__(self, address: str = '127.0.0.1', port: int = 0, answer: str = '10.0.0.1', ttl: int = 300,
+                 latency: float = 0.0) -> None:
+        self.queries: Counter = Counter()
+        server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self) -> None:
+                query, sock = self.request
+                server.queries[parse_question(query)[0]] += 1
+                if latency:
+                    time.sleep(latency)
+                sock.sendto(build_response(query, answer, ttl), self.client_address)
+
+        self.server = socketserver.ThreadingUDPServer((address, port), Handler)
+        self.server.daemon_threads = True
+        self.address, self.port = self.server.server_address
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def ask(address: str, port: int, query: bytes, timeout: float = 5) -> bytes:
+    """
+    Sends a query and waits for its response.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        sock.sendto(query, (address, port))
+        return sock.recvfrom(65535)[0]
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.gateway
+    ~~~~~~~~~~~~~
+
+    Local stand-in for the Fortigate VPN Server, used by the tests and the benchmarks.
+"""
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COOKIE = 'fake-svpn-cookie'
+AUTH_ID = 'fake-auth-id'
+
+XML_CONFIG = """<?xml version="1.0" encoding="utf-8"?>
+<sslvpn-tunnel ver="2" dtls="1" patch="1">
+  <dtls-config heartbeat-interval="10" heartbeat-fail-count="10" heartbeat-idle-timeout="10" client-hello-timeout="10"/>
+  <tunnel-method value="ppp"/>
+  <fos platform="FG100F" major="7" minor="00" patch="12" build="0523" branch="0523"/>
+  <client-config save-password="off" keep-alive="on" auto-connect="off"/>
+  <ipv4>
+    <dns ip="10.0.0.53"/>
+    <split-dns domains="corp.example.com" dnsserver1="10.0.0.53" dnsserver2=""/>
+    <assigned-addr ipv4="10.212.134.200"/>
+    <split-tunnel-info>
+      <addr ip="10.0.0.0" mask="255.0.0.0"/>
+    </split-tunnel-info>
+  </ipv4>
+  <idle-timeout val="3600"/>
+  <auth-timeout val="28800"/>
+</sslvpn-tunnel>
+"""
+
+
+class StandInGateway(object):
+    """
+    Answers the endpoints used by the login and by openconnect, like a Fortigate VPN Server would.
+    """
+    def __init__(self, hostname: str = '127.0.0.1') -> None:
+        """
+        Args:
+            hostname (str): host used on `url`, like `localhost` to make clients resolve it
+        """
+        self.requests: Counter = Counter()
+        # requests that came with cookies, per path
+        self.cookies: Counter = Counter()
+        gateway = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def _send(self, status: int, body: str = '', headers: tuple = ()) -> None:
+                data = body.encode()
+                self.send_response(status)
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self) -> None:
+                path = self.path.split('?')[0]
+                gateway.requests[path] += 1
+                if self.headers.get('Cookie'):
+                    gateway.cookies[path] += 1
+                if self.path == '/remote/saml/start?redirect=1':
+                    self._send(200, "<html><script>window.location='https://idp.example.com/login'</script></html>",
+                               [('Set-Cookie', 'SAMLSTART=1; Path=/')])
+                elif path == '/remote/saml/auth_id':
+                    if self.path.endswith(f"id={AUTH_ID}"):
+                        self._send(200, 'ok', [('Set-Cookie', f"SVPNCOOKIE={COOKIE}; Path=/")])
+                    else:
+                        self._send(403)
+                elif path == '/remote/fortisslvpn_xml':
+                    if f"SVPNCOOKIE={COOKIE}" in self.headers.get('Cookie', ''):
+                        self._send(200, XML_CONFIG)
+                    else:
+                        self._send(403)
+                else:
+                    self._send(404)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://{hostname}:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
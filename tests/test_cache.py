@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.test_cache
+    ~~~~~~~~~~~~~~~~
+
+    Persistent address cache and its use by the Fortigate HTTP calls.
+"""
+import json
+import os
+import socket
+import stat
+import time
+from fortigate_vpn_login.cache import Cache
+from fortigate_vpn_login.fortigate import Fortigate
+from tests.gateway import StandInGateway
+
+
+def test_resolve_and_persist(tmp_path):
+    cache = Cache(tmp_path / 'cache.json', ttl=60)
+    assert cache.resolve('localhost', 443) == '127.0.0.1'
+    assert cache.write()
+
+    assert stat.S_IMODE(os.stat(tmp_path / 'cache.json').st_mode) == 0o600
+    assert Cache(tmp_path / 'cache.json').get_address('localhost') == '127.0.0.1'
+
+
+def test_ipv6(tmp_path):
+    cache = Cache(tmp_path / 'cache.json')
+    assert cache.resolve('::1', 443) == '::1'
+    assert cache.addresses['::1']['family'] == socket.AF_INET6
+
+
+def test_expired_entries(tmp_path):
+    with open(tmp_path / 'cache.json', 'w') as fp:
+        json.dump({'addresses': {
+            'old.example.com': {'address': '192.0.2.1', 'expires': time.time() - 1},
+            'new.example.com': {'address': '192.0.2.2', 'expires': time.time() + 60},
+        }}, fp)
+
+    cache = Cache(tmp_path / 'cache.json')
+    assert cache.get_address('old.example.com') is None
+    assert cache.get_address('new.example.com') == '192.0.2.2'
+
+
+def test_unchanged_cache_is_not_written(tmp_path):
+    cache = Cache(tmp_path / 'cache.json')
+    assert cache.write()
+    assert not (tmp_path / 'cache.json').exists()
+
+
+def test_requests_use_the_cache(tmp_path):
+    gateway = StandInGateway('vpn.invalid')
+    gateway.start()
+    try:
+        cache = Cache(tmp_path / 'cache.json')
+        cache.set_address('vpn.invalid', '127.0.0.1')
+        assert Fortigate(gateway.url, cache).connect_saml()
+    finally:
+        gateway.stop()
+
+
+def test_failed_cached_address_is_resolved_again(tmp_path):
+    gateway = StandInGateway('localhost')
+    gateway.start()
+    try:
+        cache = Cache(tmp_path / 'cache.json')
+        # nothing listens there, like an old address of the server
+        cache.set_address('localhost', '127.0.0.9')
+        assert Fortigate(gateway.url, cache).connect_saml()
+        assert cache.get_address('localhost') == '127.0.0.1'
+    finally:
+        gateway.stop()
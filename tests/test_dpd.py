@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.test_dpd
+    ~~~~~~~~~~~~~~
+
+    Learning of the DPD interval per network.
+"""
+import json
+import os
+from fortigate_vpn_login import dpd
+
+
+def test_drop_halves_the_interval_and_sets_a_ceiling(tmp_path):
+    tuner = dpd.DPDTuner(tmp_path / 'dpd.json')
+    assert tuner.get_interval('home') == dpd.DEFAULT_INTERVAL
+
+    assert tuner.record('home', 600, dropped=True) == 30
+    assert tuner.networks['home']['ceiling'] == 60
+    assert tuner.record('home', 600, dropped=True) == 15
+    assert tuner.record('home', 600, dropped=True) == dpd.MIN_INTERVAL
+    assert tuner.networks['home']['drops'] == 3
+
+    # other networks aren't affected
+    assert tuner.get_interval('office') == dpd.DEFAULT_INTERVAL
+
+
+def test_stable_sessions_raise_the_interval_below_the_ceiling(tmp_path):
+    tuner = dpd.DPDTuner(tmp_path / 'dpd.json')
+    tuner.record('home', 600, dropped=True)
+
+    intervals = [tuner.record('home', 3600 * 8, dropped=False) for _ in range(dpd.CEILING_PROBE_SESSIONS - 1)]
+    assert intervals[:3] == [37, 46, 54]
+    assert intervals[-1] == int(60 * dpd.CEILING_MARGIN)
+
+    # a short session doesn't raise it
+    tuner = dpd.DPDTuner(tmp_path / 'other.json')
+    assert tuner.record('home', 60, dropped=False) == dpd.DEFAULT_INTERVAL
+
+
+def test_ceiling_is_probed_again_after_stable_sessions(tmp_path):
+    # e.g. a drop caused by something else than the NAT
+    tuner = dpd.DPDTuner(tmp_path / 'dpd.json')
+    tuner.record('home', 600, dropped=True)
+    for _ in range(dpd.CEILING_PROBE_SESSIONS - 1):
+        tuner.record('home', 3600 * 8, dropped=False)
+    assert tuner.networks['home']['ceiling'] == 60
+
+    assert tuner.record('home', 3600 * 8, dropped=False) == 67
+    assert tuner.networks['home']['ceiling'] is None
+    assert tuner.networks['home']['stable'] == 0
+
+    # a drop while probing sets it again
+    assert tuner.record('home', 3600, dropped=True) == 33
+    assert tuner.networks['home']['ceiling'] == 67
+
+
+def test_files_without_the_stable_count(tmp_path):
+    filename = tmp_path / 'dpd.json'
+    filename.write_text('{"networks": {"home": {"interval": 30, "ceiling": 60, "sessions": 1, "drops": 1, '
+                        '"uptime": 600.0, "wakeups": 10}}}')
+    assert dpd.DPDTuner(filename).record('home', 3600 * 8, dropped=False) == 37
+
+
+def test_session_never_established_is_not_a_drop(tmp_path):
+    tuner = dpd.DPDTuner(tmp_path / 'dpd.json')
+    assert tuner.record('home', 2, dropped=True) == dpd.DEFAULT_INTERVAL
+    assert tuner.networks['home']['ceiling'] is None
+    assert tuner.networks['home']['drops'] == 0
+    assert tuner.networks['home']['sessions'] == 1
+
+
+def test_write_and_load(tmp_path):
+    filename = tmp_path / 'config' / 'dpd.json'
+    tuner = dpd.DPDTuner(filename)
+    tuner.record('home', 600, dropped=True)
+    assert tuner.write()
+
+    assert os.listdir(filename.parent) == ['dpd.json']
+    assert os.stat(filename).st_mode & 0o777 == 0o600
+    assert json.loads(filename.read_text())['networks']['home']['interval'] == 30
+    assert dpd.DPDTuner(filename).get_interval('home') == 30
+
+
+def test_write_keeps_the_previous_file_on_failure(tmp_path, monkeypatch):
+    filename = tmp_path / 'dpd.json'
+    tuner = dpd.DPDTuner(filename)
+    tuner.record('home', 600, dropped=True)
+    assert tuner.write()
+
+    def failing_dump(data, fp):
+        fp.write('{"networks": ')
+        raise OSError('No space left on device')
+
+    monkeypatch.setattr(dpd.json, 'dump', failing_dump)
+    tuner.record('home', 600, dropped=True)
+    assert not tuner.write()
+    monkeypatch.undo()
+    assert dpd.DPDTuner(filename).get_interval('home') == 30
+
+
+def test_report(tmp_path):
+    tuner = dpd.DPDTuner(tmp_path / 'dpd.json')
+    assert tuner.report() == 'No sessions recorded yet.'
+    tuner.record('home', 3600, dropped=True)
+    assert tuner.report('home') == 'home: interval 30s, 1 sessions, 1.0h up, 1 drops (1.00/h), 60 wakeups/h'
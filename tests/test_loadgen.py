@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.test_loadgen
+    ~~~~~~~~~~~~~~~~~~
+
+    Load generator against the stand-in gateway.
+"""
+from argparse import Namespace
+import pytest
+from fortigate_vpn_login import cli, config, loadgen
+
+
+@pytest.mark.parametrize('values, percent, expected', [
+    (list(range(1, 7)), 50, 3),
+    (list(range(1, 11)), 10, 1),
+    (list(range(1, 11)), 0, 1),
+    (list(range(1, 11)), 100, 10),
+    (list(range(1, 101)), 7, 7),
+    (list(range(1, 101)), 99, 99),
+    ([5.0], 99, 5.0),
+    ([], 50, 0.0),
+])
+def test_percentile(values, percent, expected):
+    assert loadgen.percentile(values, percent) == expected
+
+
+def test_run(gateway):
+    report = loadgen.LoadGenerator(gateway.url, requests_count=60, concurrency=4).run()
+
+    # without a login, the stand-in rejects the fake auth id and the config request, as expected
+    assert report.total == 60
+    assert report.failed == 0
+    assert report.errors == {}
+    assert report.rejected == {'auth_id': 20, 'xml_config': 20}
+    assert all(len(latencies) == 20 for latencies in report.latencies.values())
+    assert '40 rejected as expected, 0 failed' in str(report)
+    assert 'p95 ms' in str(report)
+
+
+def test_server_errors_are_failures(gateway, monkeypatch):
+    generator = loadgen.LoadGenerator(gateway.url, requests_count=9, concurrency=3)
+
+    class Response(object):
+        status_code = 503
+
+    monkeypatch.setattr(generator.session.__class__, 'get', lambda *args, **kwargs: Response())
+    report = generator.run()
+    assert report.failed == 9
+    assert report.rejected == {}
+    assert report.errors == {'saml_start: HTTP 503': 3, 'auth_id: HTTP 503': 3, 'xml_config: HTTP 503': 3}
+
+
+def test_workers_have_their_own_cookies(gateway):
+    loadgen.LoadGenerator(gateway.url, requests_count=40, concurrency=4, endpoints=['saml_start']).run()
+
+    # only the first request of each worker comes without the cookie set by saml/start
+    without_cookies = gateway.requests['/remote/saml/start'] - gateway.cookies['/remote/saml/start']
+    assert 1 < without_cookies <= 4
+
+
+def test_unexpected_errors_are_counted(gateway, monkeypatch):
+    generator = loadgen.LoadGenerator(gateway.url, requests_count=10, concurrency=2, endpoints=['xml_config'])
+
+    def broken_get(*args, **kwargs):
+        raise ValueError('broken')
+
+    monkeypatch.setattr(generator.session.__class__, 'get', broken_get)
+    report = generator.run()
+    assert report.total == 10
+    assert report.errors == {'xml_config: ValueError': 10}
+
+
+@pytest.mark.parametrize('arguments', [
+    {'requests_count': 0},
+    {'requests_count': -1},
+    {'concurrency': 0},
+    {'rate': 0},
+    {'endpoints': ['unknown']},
+])
+def test_invalid_arguments(arguments):
+    with pytest.raises(ValueError):
+        loadgen.LoadGenerator('https://vpn.example.com', **arguments)
+
+
+def test_cli_usage_errors(tmp_path):
+    options = config.Config(config_filename=str(tmp_path / 'config.ini'))
+    args = Namespace(FORTI_URL='https://vpn.example.com', LOADGEN_REQUESTS=10, LOADGEN_CONCURRENCY=0,
+                     LOADGEN_RATE=None, LOADGEN_ENDPOINTS='saml_start')
+    assert cli.run_loadgen(args, options) == 2
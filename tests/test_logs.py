@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.test_logs
+    ~~~~~~~~~~~~~~~
+
+    Secret redaction and the JSON records.
+"""
+import io
+import json
+import logging
+import pytest
+from fortigate_vpn_login import logs
+
+
+@pytest.fixture
+def stream(monkeypatch):
+    """
+    A logger with a handler set up like the root one, which writes to the returned stream.
+    """
+    monkeypatch.setattr(logs, '_secrets', set())
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.addFilter(logs.RedactingFilter())
+    logger = logging.getLogger('tests.logs')
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    stream.logger = logger
+    stream.handler = handler
+    yield stream
+    logger.removeHandler(handler)
+
+
+def test_redact_patterns():
+    assert logs.redact("{'SVPNCOOKIE': 'abc123'}") == f"{{'SVPNCOOKIE': '{logs.REDACTED}'}}"
+    assert logs.redact('--cookie=SVPNCOOKIE=abc123; other') == f"--cookie=SVPNCOOKIE={logs.REDACTED}; other"
+    assert logs.redact('GET /remote/saml/auth_id?id=xyz&a=1') == f"GET /remote/saml/auth_id?id={logs.REDACTED}&a=1"
+
+
+def test_registered_secrets(stream):
+    logs.add_secret('s3cr3t-token')
+    logs.add_secret('abc')
+    stream.logger.debug("Got token: %s, abc", 's3cr3t-token')
+    assert stream.getvalue() == f"Got token: {logs.REDACTED}, abc\n"
+
+
+def test_arguments_not_matching_the_message(stream):
+    logs.add_secret('s3cr3t-token')
+    stream.logger.debug("Got token: %s and %s", 's3cr3t-token')
+    stream.logger.debug("Got %d", 'text')
+    stream.logger.debug("Still logging")
+    assert stream.getvalue().splitlines() == ['Got token: %s and %s', 'Got %d', 'Still logging']
+
+
+def test_json_records(stream):
+    logs.add_secret('s3cr3t-token')
+    stream.handler.setFormatter(logs.JSONFormatter())
+    stream.logger.info("Connected to %s", 'vpn.example.com', extra={'phase': 'connect', 'token': 's3cr3t-token'})
+
+    data = json.loads(stream.getvalue())
+    assert data['message'] == 'Connected to vpn.example.com'
+    assert data['level'] == 'INFO'
+    assert data['phase'] == 'connect'
+    assert data['token'] == logs.REDACTED
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.test_netwatch
+    ~~~~~~~~~~~~~~~~~~~
+
+    Network change parsing, the pre-warm and the reconnection loop of --watch.
+"""
+import socket
+import struct
+from argparse import Namespace
+import pytest
+from fortigate_vpn_login import cli, config, dpd, netwatch, webserver
+from fortigate_vpn_login.fortigate import Fortigate
+from tests.gateway import AUTH_ID
+
+
+def link_message(message_type, name):
+    attribute = name.encode() + b'\0'
+    attribute = struct.pack('=HH', 4 + len(attribute), netwatch._NAME_ATTRIBUTE) + attribute
+    attribute += b'\0' * (-len(attribute) % 4)
+    body = b'\0' * 16 + attribute
+    return struct.pack('=IHHII', 16 + len(body), message_type, 0, 0, 0) + body
+
+
+def address_message(message_type, index):
+    # IPv6 addresses have no IFA_LABEL, only the interface index
+    body = struct.pack('=BBBBI', socket.AF_INET6, 64, 0, 0, index)
+    return struct.pack('=IHHII', 16 + len(body), message_type, 0, 0, 0) + body
+
+
+def test_parse_messages():
+    data = link_message(netwatch.RTM_NEWLINK, 'wlan0') + link_message(netwatch.RTM_DELLINK, 'tun0')
+    assert netwatch.parse_messages(data) == [(netwatch.RTM_NEWLINK, 'wlan0'), (netwatch.RTM_DELLINK, 'tun0')]
+    assert netwatch.parse_messages(b'\0' * 8) == []
+
+
+def test_parse_ipv6_address_messages():
+    data = address_message(netwatch.RTM_NEWADDR, socket.if_nametoindex('lo'))
+    data += address_message(netwatch.RTM_DELADDR, 2 ** 31)
+    assert netwatch.parse_messages(data) == [(netwatch.RTM_NEWADDR, 'lo'), (netwatch.RTM_DELADDR, None)]
+
+
+def test_prewarm(gateway, monkeypatch):
+    fortigate = Fortigate(gateway.url)
+    assert not fortigate.prewarmed
+    assert fortigate.prewarm()
+    assert fortigate.prewarmed
+    assert gateway.requests['/remote/saml/start'] == 1
+
+    # the next login uses it, without asking the server again
+    assert fortigate.connect_saml() == 'https://idp.example.com/login'
+    assert gateway.requests['/remote/saml/start'] == 1
+    assert not fortigate.prewarmed
+
+    assert fortigate.prewarm()
+    monkeypatch.setattr(Fortigate, 'PREWARM_MAX_AGE', 0)
+    assert not fortigate.prewarmed
+
+
+def test_prewarm_unreachable_server():
+    assert not Fortigate('http://127.0.0.1:9').prewarm()
+
+
+def test_prewarmer_webserver(gateway, monkeypatch):
+    started = []
+
+    class Process(object):
+        def is_alive(self):
+            return True
+
+    monkeypatch.setattr(webserver, 'run', lambda profiler=None: started.append(Process()) or started[-1])
+    prewarmer = netwatch.Prewarmer(Fortigate(gateway.url))
+    assert not prewarmer.warm
+    assert prewarmer.prewarm()
+    assert prewarmer.warm
+
+    # the listener is started only once
+    assert prewarmer.prewarm()
+    assert len(started) == 1
+    assert prewarmer.take_webserver() is started[0]
+    assert not prewarmer.warm
+
+
+class FakePrewarmer(object):
+    def __init__(self, results, warm=False):
+        self.results = list(results)
+        self.warm = warm
+        self.attempts = 0
+
+    def prewarm(self):
+        self.attempts += 1
+        return self.results.pop(0)
+
+    def take_webserver(self):
+        return None
+
+
+class FakeWatcher(object):
+    def __init__(self, changes):
+        self.changes = list(changes)
+        self.timeouts = []
+
+    def wait(self, timeout=None):
+        self.timeouts.append(timeout)
+        return self.changes.pop(0)
+
+
+@pytest.fixture
+def watched_connect(gateway, tmp_path, monkeypatch):
+    """
+    Runs `cli.connect()` with --watch against the stand-in gateway, with the browser login already
+    done and an openconnect which runs for as many network checks as there are in `changes`.
+    """
+    monkeypatch.setattr(webserver, 'run', lambda profiler=None: None)
+    monkeypatch.setattr(webserver, 'quit', lambda ws: None)
+    monkeypatch.setattr(webserver, 'return_token', lambda: AUTH_ID)
+    monkeypatch.setattr(cli.webbrowser, 'open', lambda url: True)
+    monkeypatch.setattr(cli, 'WATCH_RETRY_MIN', 0)
+    commands = []
+
+    def connect(changes, prewarmer, **settings):
+        watcher = FakeWatcher(changes)
+
+        class Popen(object):
+            def __init__(self, command_line, **kwargs):
+                commands.append(command_line)
+                self.returncode = None
+
+            def poll(self):
+                if not watcher.changes:
+                    self.returncode = 0
+                return self.returncode
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                pass
+
+        monkeypatch.setattr(cli.subprocess, 'Popen', Popen)
+        options = config.Config(config_filename=str(tmp_path / 'config.ini'), **settings)
+        args = Namespace(SPLIT_DNS=False, NATIVE_SCRIPT=False, QUIET_MODE=False, DEBUG_MODE=False, BACKGROUND=False)
+        cli.connect(args, options, Fortigate(gateway.url), 'openconnect', None, watcher, prewarmer)
+        return commands[-1]
+
+    return connect
+
+
+def test_watch_limits_the_reconnect_timeout(watched_connect):
+    command_line = watched_connect([False], FakePrewarmer([]))
+    assert f"--reconnect-timeout={cli.WATCH_RECONNECT_TIMEOUT}" in command_line
+    assert cli.WATCH_RECONNECT_TIMEOUT < Fortigate.PREWARM_MAX_AGE
+
+
+def test_watch_keeps_the_login_warm_after_a_network_change(watched_connect):
+    # nothing changed: nothing to warm up
+    prewarmer = FakePrewarmer([])
+    watched_connect([False, False, False], prewarmer)
+    assert prewarmer.attempts == 0
+
+    # the warmed up login expires (or the server can't be reached yet) while the tunnel is dying
+    prewarmer = FakePrewarmer([True, True, True])
+    watched_connect([True, False, False], prewarmer)
+    assert prewarmer.attempts == 3
+
+    # but it's kept as it is while it's warm
+    prewarmer = FakePrewarmer([True], warm=True)
+    watched_connect([True, False, False], prewarmer)
+    assert prewarmer.attempts == 1
+
+
+def test_wait_for_server_keeps_a_warm_login():
+    prewarmer = FakePrewarmer([], warm=True)
+    watcher = FakeWatcher([])
+    cli.wait_for_server(prewarmer, watcher)
+    assert prewarmer.attempts == 0
+    assert watcher.timeouts == []
+
+
+def test_wait_for_server_backs_off():
+    prewarmer = FakePrewarmer([False] * 7 + [True])
+    watcher = FakeWatcher([False, False, False, True, False, False, False])
+    cli.wait_for_server(prewarmer, watcher)
+
+    assert prewarmer.attempts == 8
+    # never waits forever; a network change retries right away and resets the delay
+    assert watcher.timeouts == [5, 10, 20, 40, 5, 10, 20]
+
+
+def test_wait_for_server_delay_is_bounded():
+    prewarmer = FakePrewarmer([False] * 10 + [True])
+    watcher = FakeWatcher([False] * 10)
+    cli.wait_for_server(prewarmer, watcher)
+    assert max(watcher.timeouts) == cli.WATCH_RETRY_MAX
+
+
+def test_dpd_isnt_learned_across_network_changes(watched_connect, tmp_path, monkeypatch):
+    # before and after each session; the first one doesn't need to look after it
+    networks = iter(['home', 'home', 'home', 'home', 'office'])
+    monkeypatch.setattr(dpd, 'get_network_id', lambda: next(networks))
+
+    # the tunnel died after roaming, noticed by the watcher
+    watched_connect([True, False], FakePrewarmer([True], warm=True), adaptive_dpd='True')
+    assert not (tmp_path / 'dpd.json').exists()
+
+    # the session lasted on the same network
+    watched_connect([False], FakePrewarmer([]), adaptive_dpd='True')
+    assert dpd.DPDTuner(tmp_path / 'dpd.json').networks['home']['sessions'] == 1
+
+    # the network changed without the watcher noticing it
+    watched_connect([False], FakePrewarmer([]), adaptive_dpd='True')
+    assert dpd.DPDTuner(tmp_path / 'dpd.json').networks['home']['sessions'] == 1
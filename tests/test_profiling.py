@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.test_profiling
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Phase hooks, the cProfile wrapper, collapsed stacks and the tracemalloc snapshots, including
+    the ones of the callback listener process.
+"""
+import cProfile
+import io
+import pickle
+import pstats
+import socket
+import time
+import pytest
+from fortigate_vpn_login import profiling, webserver
+
+
+@pytest.fixture(autouse=True)
+def hooks(monkeypatch):
+    monkeypatch.setattr(profiling, '_hooks', [])
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def c(seconds):
+    busy(seconds)
+
+
+def a():
+    c(0.02)
+
+
+def b():
+    c(0.06)
+
+
+def read_stacks(filename):
+    stacks = {}
+    for line in open(filename):
+        stack, microseconds = line.rsplit(' ', 1)
+        frames = [frame.split(' ')[0] for frame in stack.split(';')]
+        stacks[';'.join(frames)] = stacks.get(';'.join(frames), 0) + int(microseconds)
+    return stacks
+
+
+def test_hooks():
+    events = []
+
+    def hook(name, event):
+        events.append((name, event))
+
+    def failing_hook(name, event):
+        raise RuntimeError('broken hook')
+
+    profiling.add_hook(hook)
+    profiling.add_hook(hook)
+    profiling.add_hook(failing_hook)
+    with profiling.phase('connect_saml'):
+        events.append('inside')
+
+    profiling.remove_hook(hook)
+    profiling.remove_hook(hook)
+    with pytest.raises(ValueError):
+        with profiling.phase('callback'):
+            raise ValueError('the phase failed')
+
+    assert events == [('connect_saml', 'start'), 'inside', ('connect_saml', 'end')]
+
+
+def test_profiler_formats(tmp_path):
+    with pytest.raises(ValueError):
+        profiling.Profiler(str(tmp_path / 'login.prof'), 'svg')
+
+    profiler = profiling.Profiler(str(tmp_path / 'login.prof'))
+    profiler.start()
+    a()
+    profiler.stop()
+    profiler.stop()
+    assert pstats.Stats(str(tmp_path / 'login.prof')).total_calls > 0
+
+
+def test_profiler_for_process_is_picklable(tmp_path):
+    profiler = profiling.Profiler(str(tmp_path / 'login.folded'), 'collapsed')
+    profiler.start()
+    child = pickle.loads(pickle.dumps(profiler.for_process('callback')))
+    running = pickle.loads(pickle.dumps(profiler))
+    profiler.stop()
+
+    assert child.filename == f"{tmp_path / 'login.folded'}.callback"
+    assert child.output_format == 'collapsed'
+    assert running._profile is None
+
+    child.start()
+    b()
+    child.stop()
+    assert 'b;c;busy' in read_stacks(child.filename)
+
+
+def test_collapsed_stacks_split_own_time_across_callers(tmp_path):
+    profile = cProfile.Profile()
+    profile.enable()
+    a()
+    b()
+    profile.disable()
+    profiling.write_collapsed(pstats.Stats(profile), str(tmp_path / 'out.folded'))
+
+    stacks = read_stacks(tmp_path / 'out.folded')
+    from_a = stacks['a;c;busy']
+    from_b = stacks['b;c;busy']
+    assert 0.2 < from_a / from_b < 0.5
+
+
+def test_malloc_tracer():
+    stream = io.StringIO()
+    tracer = profiling.MallocTracer(limit=3, stream=stream)
+    tracer.start()
+    assert profiling.get_malloc_tracer() is tracer
+    with profiling.phase('get_cookie'):
+        data = [bytearray(1000) for _ in range(100)]
+    tracer.stop()
+    assert profiling.get_malloc_tracer() is None
+
+    lines = stream.getvalue().splitlines()
+    assert lines[0].startswith('tracemalloc [get_cookie]: current=')
+    assert 1 <= len(lines[1:]) <= 3
+    assert len(data) == 100
+
+    child = pickle.loads(pickle.dumps(tracer))
+    assert child.limit == 3
+
+
+def test_malloc_tracer_covers_the_callback_listener(capfd):
+    tracer = profiling.MallocTracer(limit=3, stream=io.StringIO())
+    tracer.start()
+    try:
+        ws = webserver.run()
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', 8020), timeout=1).close()
+                break
+            except OSError:
+                assert time.monotonic() < deadline
+                time.sleep(0.01)
+        webserver.quit(ws)
+    finally:
+        tracer.stop()
+
+    assert 'tracemalloc [callback listener]: current=' in capfd.readouterr().err
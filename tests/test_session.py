@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.test_session
+    ~~~~~~~~~~~~~~~~~~
+
+    SessionManager against the fake openconnect binary and the stand-in gateway.
+"""
+import os
+import time
+import psutil
+import pytest
+from fortigate_vpn_login import utils
+from fortigate_vpn_login.session import SessionError, SessionManager
+from tests.gateway import COOKIE
+
+SESSIONS = 50
+
+
+@pytest.fixture
+def manager(fake_openconnect, tmp_path):
+    manager = SessionManager(fake_openconnect, tmp_path / 'sessions')
+    yield manager
+    manager.stop_all(timeout=5)
+
+
+def wait_until_connected(sessions, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if all('Connected as' in session.log_filename.read_text() for session in sessions):
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_start_many_sessions(manager, gateway):
+    sessions = [manager.start(f"session-{number}", gateway.url, COOKIE) for number in range(SESSIONS)]
+
+    assert len(manager) == SESSIONS
+    assert len({session.interface for session in sessions}) == SESSIONS
+    assert len({session.log_filename for session in sessions}) == SESSIONS
+    assert wait_until_connected(sessions)
+    assert all(session.pid_filename.read_text() == str(session.process.pid) for session in sessions)
+    assert manager.poll() == []
+    assert len(manager.running()) == SESSIONS
+    assert gateway.requests['/remote/fortisslvpn_xml'] == SESSIONS
+
+    with pytest.raises(SessionError):
+        manager.start('session-0', gateway.url, COOKIE)
+
+
+def test_rejected_cookies_end_sessions(manager, gateway):
+    good = [manager.start(f"good-{number}", gateway.url, COOKIE) for number in range(SESSIONS // 2)]
+    bad = [manager.start(f"bad-{number}", gateway.url, 'invalid') for number in range(SESSIONS // 2)]
+
+    ended = []
+    deadline = time.monotonic() + 20
+    while len(ended) < len(bad) and time.monotonic() < deadline:
+        ended += manager.wait(deadline - time.monotonic())
+
+    assert {session.name for session in ended} == {session.name for session in bad}
+    assert all(session.returncode == 2 for session in ended)
+    assert all(session.status == utils.VPNStatus.DISCONNECTED for session in ended)
+    assert all('rejected' in session.log_filename.read_text() for session in ended)
+    assert set(manager.running()) == set(good)
+
+
+def test_wait_timeout(manager, gateway):
+    manager.start('session', gateway.url, COOKIE)
+
+    start = time.monotonic()
+    assert manager.wait(0.5) == []
+    assert 0.4 < time.monotonic() - start < 5
+
+
+def test_wait_without_sessions(manager):
+    assert manager.wait() == []
+
+
+def test_stop(manager, gateway):
+    session = manager.start('session', gateway.url, COOKIE)
+    assert wait_until_connected([session])
+
+    assert manager.stop('session') == 0
+    assert not session.running
+    assert not session.pid_filename.exists()
+    assert manager.poll() == []
+
+    with pytest.raises(SessionError):
+        manager.stop('unknown')
+
+
+def test_stop_all(manager, gateway):
+    sessions = [manager.start(f"session-{number}", gateway.url, COOKIE) for number in range(SESSIONS)]
+    assert wait_until_connected(sessions)
+
+    start = time.monotonic()
+    manager.stop_all(timeout=10)
+
+    # all of them are signaled at once, so it doesn't take one timeout per session
+    assert time.monotonic() - start < 10
+    assert manager.running() == []
+    assert all(session.returncode == 0 for session in sessions)
+    assert not any(session.pid_filename.exists() for session in sessions)
+
+
+def test_pid_file_has_the_openconnect_pid(manager, gateway):
+    session = manager.start('session', gateway.url, COOKIE)
+    assert session.pid_filename.read_text() == str(session.process.pid)
+
+    # the fake, like the real openconnect, only writes --pid-file in background
+    assert '--pid-file' not in ' '.join(session.process.args)
+
+
+def test_stop_through_sudo(fake_openconnect, fake_sudo, gateway, tmp_path, monkeypatch):
+    # openconnect doesn't log out on SIGTERM, so it has to be killed
+    monkeypatch.setenv('FAKE_OPENCONNECT_IGNORE_TERM', '1')
+    manager = SessionManager(fake_openconnect, tmp_path / 'sessions')
+    session = manager.start('session', gateway.url, COOKIE)
+    assert session.elevated
+    assert wait_until_connected([session])
+
+    # sudo started it meanwhile, found on the next check
+    assert manager.poll() == []
+    pid = int(session.pid_filename.read_text())
+    assert pid != session.process.pid
+    assert psutil.Process(pid).name() == 'openconnect'
+
+    manager.stop('session', timeout=0.5)
+    assert not session.running
+    assert not psutil.pid_exists(pid) or psutil.Process(pid).status() == psutil.STATUS_ZOMBIE
+    assert not os.path.exists(session.pid_filename)
+
+
+def test_interface_reused_after_stop(manager, gateway):
+    first = manager.start('first', gateway.url, COOKIE, interface='fvl0')
+    manager.stop('first')
+    second = manager.start('second', gateway.url, COOKIE)
+
+    assert first.interface == 'fvl0'
+    assert second.interface == 'fvl0'
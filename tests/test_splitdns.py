@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.test_splitdns
+    ~~~~~~~~~~~~~~~~~~~
+
+    Split DNS forwarder against stand-in DNS servers, and its registration by the vpnc-script.
+"""
+import os
+import socket
+import struct
+import time
+from argparse import Namespace
+import pytest
+import xmltodict
+from fortigate_vpn_login import cli, config, splitdns, vpnc_script, webserver
+from fortigate_vpn_login.fortigate import Fortigate
+from tests.dns import StandInDNSServer, ask, build_query, build_response
+from tests.gateway import AUTH_ID, XML_CONFIG
+
+
+@pytest.fixture
+def servers():
+    vpn = StandInDNSServer('127.0.0.2', answer='10.0.0.1')
+    local = StandInDNSServer('127.0.0.3', vpn.port, answer='192.0.2.1')
+    vpn.start()
+    local.start()
+    yield vpn, local
+    vpn.stop()
+    local.stop()
+
+
+@pytest.fixture
+def resolver(servers):
+    vpn, _ = servers
+    resolver = splitdns.SplitDNSResolver([(['corp.example.com'], ['127.0.0.2'])], ['127.0.0.3'], '127.0.0.1', 0,
+                                         upstream_port=vpn.port)
+    resolver.start()
+    yield resolver
+    resolver.stop()
+
+
+def ttl_of(response):
+    return struct.unpack('!I', response[-10:-6])[0]
+
+
+def test_config():
+    json_config = xmltodict.parse(XML_CONFIG)
+    assert splitdns.get_vpn_routes(json_config) == [(['corp.example.com'], ['10.0.0.53'])]
+    assert splitdns.get_assigned_address(json_config) == '10.212.134.200'
+
+
+def test_routing(resolver, servers):
+    vpn, local = servers
+    assert ask('127.0.0.1', resolver.port, build_query('intranet.corp.example.com'))[-4:] == bytes([10, 0, 0, 1])
+    assert ask('127.0.0.1', resolver.port, build_query('www.example.org'))[-4:] == bytes([192, 0, 2, 1])
+    assert vpn.queries == {'intranet.corp.example.com': 1}
+    assert local.queries == {'www.example.org': 1}
+
+
+def test_cache(resolver, servers):
+    vpn, _ = servers
+    for query_id in range(10):
+        response = ask('127.0.0.1', resolver.port, build_query('intranet.corp.example.com', query_id=query_id))
+        assert response[:2] == struct.pack('!H', query_id)
+
+    assert vpn.queries['intranet.corp.example.com'] == 1
+    assert resolver.stats['hits'] == 9
+
+
+def test_cached_answers_have_the_remaining_ttl(resolver, monkeypatch):
+    query = build_query('intranet.corp.example.com')
+    assert ttl_of(resolver.resolve(query)) == 300
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 100)
+    assert ttl_of(resolver.resolve(query)) == 200
+
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 301)
+    resolver.resolve(query)
+    assert resolver.stats['hits'] == 1
+
+
+def test_cache_size_is_bounded(resolver, monkeypatch):
+    monkeypatch.setattr(splitdns, 'MAX_CACHE_ENTRIES', 10)
+    for number in range(25):
+        resolver.resolve(build_query(f"host{number}.corp.example.com"))
+
+    assert len(resolver.cache) == 10
+    # the newest ones are kept
+    assert ('host24.corp.example.com', 1, 1) in resolver.cache
+
+
+def test_negative_answers_are_cached(resolver, servers):
+    vpn, _ = servers
+    for _ in range(3):
+        response = resolver.resolve(build_query('missing.corp.example.com'))
+        assert response[3] & 0x0f == 3
+
+    assert vpn.queries['missing.corp.example.com'] == 1
+
+
+def test_age_response():
+    response = build_response(build_query('host.example.com'), '10.0.0.1', 60)
+    assert ttl_of(splitdns.age_response(response, 20.5)) == 40
+    assert ttl_of(splitdns.age_response(response, 90)) == 0
+
+
+def test_listen_on_tunnel_address_before_it_exists(servers):
+    vpn, _ = servers
+    resolver = splitdns.SplitDNSResolver([], ['127.0.0.3'], '10.212.134.200', 0, upstream_port=vpn.port)
+    resolver.start()
+    resolver.stop()
+
+
+def test_privileged_port(tmp_path):
+    sysctl = tmp_path / 'ip_unprivileged_port_start'
+    sysctl.write_text('1024\n')
+    assert splitdns.is_privileged_port(53, str(sysctl))
+    assert not splitdns.is_privileged_port(10053, str(sysctl))
+    assert not splitdns.is_privileged_port(0, str(sysctl))
+
+    sysctl.write_text('0\n')
+    assert not splitdns.is_privileged_port(53, str(sysctl))
+    assert splitdns.is_privileged_port(53, str(tmp_path / 'missing'))
+
+
+@pytest.fixture
+def login(gateway, tmp_path, monkeypatch):
+    """
+    Runs `cli.connect()` with --split-dns against the stand-in gateway, with the browser login
+    already done and openconnect never run.
+    """
+    monkeypatch.setattr(webserver, 'run', lambda profiler=None: None)
+    monkeypatch.setattr(webserver, 'quit', lambda ws: None)
+    monkeypatch.setattr(webserver, 'return_token', lambda: AUTH_ID)
+    monkeypatch.setattr(cli.webbrowser, 'open', lambda url: True)
+    monkeypatch.setattr(cli.subprocess, 'run', lambda *args, **kwargs: pytest.fail('openconnect was run'))
+
+    def login(port):
+        options = config.Config(config_filename=str(tmp_path / 'config.ini'), split_dns_address='127.0.0.1',
+                                split_dns_port=str(port))
+        args = Namespace(SPLIT_DNS=True, NATIVE_SCRIPT=False, QUIET_MODE=False, DEBUG_MODE=False, BACKGROUND=False)
+        return cli.connect(args, options, Fortigate(gateway.url), 'openconnect')
+
+    return login
+
+
+def test_busy_port_is_an_error(login, gateway, capsys):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        assert login(sock.getsockname()[1]) == 1
+
+    assert 'ERROR: Could not listen on 127.0.0.1' in capsys.readouterr().out
+
+
+def test_privileged_port_needs_root_before_the_login(login, gateway, capsys, monkeypatch):
+    monkeypatch.setattr(os, 'getuid', lambda: 1000)
+    monkeypatch.setattr(splitdns, 'is_privileged_port', lambda port: port == 53)
+    assert login(53) == 1
+
+    assert 'requires running fortigate-vpn-login as root' in capsys.readouterr().out
+    assert gateway.requests['/remote/saml/start'] == 0
+
+
+def test_script_environment(resolver):
+    env = resolver.get_script_environment()
+    assert env == {
+        splitdns.SPLIT_DNS_ENV: f"127.0.0.1:{resolver.port}",
+        splitdns.SPLIT_DNS_DOMAINS_ENV: 'corp.example.com',
+    }
+    assert vpnc_script.get_script_command(env).startswith(f"{splitdns.SPLIT_DNS_ENV}=127.0.0.1:{resolver.port} ")
+
+
+@pytest.fixture
+def commands(monkeypatch):
+    commands = []
+    monkeypatch.setattr(vpnc_script.subprocess, 'run', lambda command, **kwargs: commands.append(command))
+    return commands
+
+
+def test_register_with_resolved(commands, monkeypatch):
+    monkeypatch.setattr(vpnc_script, 'which', lambda name: f"/usr/bin/{name}")
+    env = {splitdns.SPLIT_DNS_ENV: '10.212.134.200:10053', splitdns.SPLIT_DNS_DOMAINS_ENV: 'corp.example.com'}
+
+    assert vpnc_script.configure_dns(env, 'tun0') is None
+    assert commands == [
+        ['resolvectl', 'dns', 'tun0', '10.212.134.200:10053'],
+        ['resolvectl', 'domain', 'tun0', '~corp.example.com'],
+        ['resolvectl', 'default-route', 'tun0', 'false'],
+    ]
+
+
+def test_register_with_resolv_conf(commands, monkeypatch, tmp_path, capsys):
+    monkeypatch.setattr(vpnc_script, 'which', lambda name: None)
+    monkeypatch.setattr(vpnc_script, 'RESOLV_CONF', tmp_path / 'resolv.conf')
+    (tmp_path / 'resolv.conf').write_text('nameserver 192.168.0.1\noptions edns0\n')
+
+    env = {splitdns.SPLIT_DNS_ENV: '10.212.134.200:10053', splitdns.SPLIT_DNS_DOMAINS_ENV: 'corp.example.com'}
+    assert vpnc_script.configure_dns(env, 'tun0') is None
+    assert 'set split_dns_port = 53 and run fortigate-vpn-login as root' in capsys.readouterr().err
+
+    env[splitdns.SPLIT_DNS_ENV] = '127.0.0.153:53'
+    previous = vpnc_script.configure_dns(env, 'tun0')
+    assert previous == 'nameserver 192.168.0.1\noptions edns0\n'
+    assert 'nameserver 127.0.0.153\noptions edns0' in (tmp_path / 'resolv.conf').read_text()
+    assert commands == []
+
+    vpnc_script.restore_resolv_conf(previous)
+    assert (tmp_path / 'resolv.conf').read_text() == previous
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+    tests.test_vpnc_script
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    Native vpnc-script, with the `ip` and `resolvectl` executions recorded instead of run.
+"""
+import os
+import subprocess
+import pytest
+from fortigate_vpn_login import vpnc_script
+
+ENV = {
+    'reason': 'connect',
+    'TUNDEV': 'tun0',
+    'VPNGATEWAY': '203.0.113.10',
+    'INTERNAL_IP4_ADDRESS': '10.212.134.200',
+    'INTERNAL_IP4_MTU': '1400',
+    'INTERNAL_IP4_DNS': '10.0.0.53 10.0.0.54',
+    'CISCO_DEF_DOMAIN': 'corp.example.com',
+    'CISCO_SPLIT_INC': '2',
+    'CISCO_SPLIT_INC_0_ADDR': '10.0.0.0',
+    'CISCO_SPLIT_INC_0_MASK': '255.0.0.0',
+    'CISCO_SPLIT_INC_1_ADDR': '172.16.1.7',
+    'CISCO_SPLIT_INC_1_MASKLEN': '24',
+    'CISCO_SPLIT_EXC': '1',
+    'CISCO_SPLIT_EXC_0_ADDR': '10.99.0.0',
+    'CISCO_SPLIT_EXC_0_MASKLEN': '16',
+}
+
+
+@pytest.fixture
+def system(monkeypatch, tmp_path):
+    """
+    Records the `ip` batches and the other executions, with the routes "installed" by them.
+    """
+    class System(object):
+        batches = []
+        commands = []
+        installed = set()
+
+    def run_batch(commands):
+        System.batches.append(commands)
+        for command in commands:
+            fields = command.split()
+            if fields[:2] == ['route', 'replace'] and 'dev' in fields and fields[fields.index('dev') + 1] == 'tun0':
+                System.installed.add(fields[2])
+            elif fields[:2] == ['route', 'del']:
+                System.installed.discard(fields[2])
+        return True
+
+    monkeypatch.setattr(vpnc_script, 'run_batch', run_batch)
+    monkeypatch.setattr(vpnc_script, 'get_tunnel_routes', lambda device: set(System.installed))
+    monkeypatch.setattr(vpnc_script, 'get_gateway_route', lambda address: 'via 192.168.0.1 dev wlan0')
+    monkeypatch.setattr(vpnc_script.subprocess, 'run', lambda command, **kwargs: System.commands.append(command))
+    monkeypatch.setattr(vpnc_script, 'which', lambda name: None)
+    monkeypatch.setattr(vpnc_script, 'STATE_DIR', tmp_path / 'run')
+    monkeypatch.setattr(vpnc_script, 'RESOLV_CONF', tmp_path / 'resolv.conf')
+    (tmp_path / 'resolv.conf').write_text('nameserver 192.168.0.1\n')
+    return System
+
+
+def test_split_routes():
+    assert vpnc_script.get_split_routes(ENV, 'INC') == {'10.0.0.0/8', '172.16.1.0/24'}
+    assert vpnc_script.get_split_routes(ENV, 'EXC') == {'10.99.0.0/16'}
+    assert vpnc_script.get_split_routes({}, 'INC') == set()
+
+
+def test_batch_only_has_the_differences():
+    assert vpnc_script.get_batch('tun0', {'10.0.0.0/8', '10.1.0.0/16'}, {'10.0.0.0/8', '10.2.0.0/16'}) == [
+        'route del 10.2.0.0/16 dev tun0 proto static',
+        'route replace 10.1.0.0/16 dev tun0 proto static',
+    ]
+
+
+def test_connect_and_reconnect(system):
+    assert vpnc_script.main(ENV) == 0
+    assert len(system.batches) == 1
+    assert system.batches[0][:2] == ['link set dev tun0 up mtu 1400', 'addr replace 10.212.134.200/32 dev tun0']
+    assert 'route replace 10.99.0.0/16 via 192.168.0.1 dev wlan0 proto static' in system.batches[0]
+    assert system.installed == {'10.0.0.0/8', '172.16.1.0/24'}
+
+    env = dict(ENV, reason='reconnect', CISCO_SPLIT_INC_1_ADDR='172.16.2.0')
+    assert vpnc_script.main(env) == 0
+    assert [command for command in system.batches[1] if command.startswith('route')] == [
+        'route del 172.16.1.0/24 dev tun0 proto static',
+        'route replace 172.16.2.0/24 dev tun0 proto static',
+    ]
+
+
+def test_full_tunnel(system):
+    env = dict(ENV, CISCO_SPLIT_INC='0')
+    assert vpnc_script.main(env) == 0
+    assert system.installed == vpnc_script.FULL_TUNNEL_ROUTES
+    assert 'route replace 203.0.113.10/32 via 192.168.0.1 dev wlan0 proto static' in system.batches[0]
+
+
+def test_dns_with_resolved(system, monkeypatch):
+    monkeypatch.setattr(vpnc_script, 'which', lambda name: f"/usr/bin/{name}")
+    assert vpnc_script.main(ENV) == 0
+    assert system.commands == [
+        ['resolvectl', 'dns', 'tun0', '10.0.0.53', '10.0.0.54'],
+        ['resolvectl', 'domain', 'tun0', '~corp.example.com'],
+    ]
+
+
+def test_dns_without_resolved(system):
+    resolv_conf = vpnc_script.RESOLV_CONF
+    assert vpnc_script.main(ENV) == 0
+    assert resolv_conf.read_text().splitlines()[1:] == [
+        'nameserver 10.0.0.53', 'nameserver 10.0.0.54', 'search corp.example.com',
+    ]
+
+    # a reconnect doesn't take our file as the original one
+    assert vpnc_script.main(dict(ENV, reason='reconnect')) == 0
+    assert vpnc_script.main(dict(ENV, reason='disconnect')) == 0
+    assert resolv_conf.read_text() == 'nameserver 192.168.0.1\n'
+    assert system.batches[-1] == ['route del 10.99.0.0/16']
+
+
+def test_script_command_without_the_package_installed(tmp_path):
+    # like root running it, without the user site-packages or the current directory
+    command = vpnc_script.get_script_command({'FORTIGATE_VPN_LOGIN_SPLIT_DNS_DOMAINS': 'a.example.com b.example.com'})
+    env = {'PATH': os.environ.get('PATH', '/usr/bin:/bin'), 'reason': 'pre-init', 'PYTHONNOUSERSITE': '1'}
+    process = subprocess.run(['/bin/sh', '-c', command], env=env, cwd=tmp_path, capture_output=True, text=True)
+    assert process.returncode == 0, process.stderr